@@ -3,24 +3,43 @@ from models import CafedraArticle, ArticleEpiskopRow
 from models import Cafedra, EpiskopOfCafedra, Note, EpiskopInfo, Dating
 
 from parsers.fail import ParseFail
-from parsers.dating import parse_dating, ParsedDating
+from parsers.dating import parse_dating, ParsedDating, \
+                           parse_dating_fast, parse_dating_pyparsing
 from parsers.episkop import parse_episkop_name_in_cafedra, \
-                            ParsedEpiskopInCafedra
+                            ParsedEpiskopInCafedra, \
+                            parse_episkop_name_fast, \
+                            parse_episkop_name_pyparsing
 
-from lib.date_intervals_builder import DateIntervalsBuilder
+from lib.date_intervals_builder import estimate_date_interval
 from lib.roman_num import from_roman
 
 import human
 
 import re
 from dataclasses import dataclass
+from datetime import date
+from functools import lru_cache
 from typing import Tuple, List
 
 
 class CafedraArticleParser(ChainLink):
+    def __init__(self, cache_file: str = None):
+        """
+        cache_file - sqlite file of RowParseCache: parsed episkop rows
+                     are taken from it, new ones are saved to it
+        """
+        self.cache = RowParseCache(cache_file) if cache_file else None
+
     @staticmethod
     @human.show_exception
-    def parse_article(art: CafedraArticle) -> Cafedra:
+    def parse_article(art: CafedraArticle,
+                      parse_row=None) -> Cafedra:
+        """
+        parse_row - function to get ParsedEpiskopRow of row text
+                    (parse_episkop_row by default)
+        """
+        parse_row = parse_row or parse_episkop_row
+
         caf = Cafedra(
                 header=art.header,
                 is_obn=art.is_obn, is_link=art.is_link,
@@ -33,7 +52,7 @@ class CafedraArticleParser(ChainLink):
                 caf.episkops.append(aep)
                 continue
 
-            pp: ParsedEpiskopRow = parse_episkop_row(aep.text)
+            pp: ParsedEpiskopRow = parse_row(aep.text)
 
             if isinstance(pp, ParseFail):
                 human.send("Can't parse this - save as header", aep.text, pp)
@@ -81,9 +100,26 @@ class CafedraArticleParser(ChainLink):
         return caf
 
     def process(self, s: CafedraArticle):
+        if self.cache:
+            return self.process_batch([s])
         pp: Cafedra = self.parse_article(s)
         self.send(pp)
 
+    def process_batch(self, items: List[CafedraArticle]):
+        parse = self.parse_article
+        if not self.cache:
+            return self.send_batch([parse(s) for s in items])
+
+        rows = {ep.text for art in items for ep in art.episkops
+                if not isinstance(ep, str)}
+        parse_row = self.cache.parse_rows(rows)
+        self.send_batch([parse(s, parse_row) for s in items])
+
+    def warmup(self):
+        # first parsing builds pyparsing internal caches
+        parse_episkop_row('01(14)01.1901	–	кон. 1902	–	'
+                          'в/у Сщмч. Иоанн II Иванов, паки')
+
 
 def to_episkop_info(parsed: ParsedEpiskopInCafedra) -> EpiskopInfo:
     if parsed is None:
@@ -109,26 +145,51 @@ def to_dating(parsed: ParsedDating) -> Dating:
     if isinstance(parsed, ParseFail):
         return Dating(dating=parsed.text, estimated_date=None)
     else:
-        b = DateIntervalsBuilder()
-        try:
-            b.add_date(parsed.year, parsed.month, parsed.day)
-            items = b.build()
-        except ValueError as ex:
-            if 'day is out of range' in str(ex):
-                human.send(str(ex), parsed)
-                items = []
-
-        if len(items) != 1:
-            if len(items) == 0:
-                msg = 'No date intervals for dating'
-            else:
-                msg = 'Many date intervals, expected single'
+        est, messages = estimate_date(parsed.year, parsed.month, parsed.day)
+        for msg in messages:
             human.send(msg, parsed)
-
-        est = items[0].begin if len(items) else None
         return Dating(dating=parsed.dating, estimated_date=est)
 
 
+@lru_cache(maxsize=2**14)
+def estimate_date(year, month, day) -> Tuple[date | None, Tuple[str, ...]]:
+    """
+    returns estimated date of dating and messages for human
+    about problems (they are sent by to_dating on every call)
+    """
+    try:
+        interval = estimate_date_interval(year, month, day)
+    except ValueError as ex:
+        if 'day is out of range' not in str(ex):
+            raise
+        return None, (str(ex), 'No date intervals for dating')
+
+    if interval is None:
+        return None, ('No date intervals for dating',)
+    return date.fromordinal(interval[0]), ()
+
+
+def parse_cache_stats() -> dict:
+    """
+    lru_cache statistics of memoized parse functions in current process
+    """
+    return {
+        'parse_dating': parse_dating.cache_info(),
+        'parse_episkop_name_in_cafedra':
+            parse_episkop_name_in_cafedra.cache_info(),
+        'to_dating': estimate_date.cache_info(),
+    }
+
+
+def clear_parse_caches():
+    """
+    clears lru caches of memoized parse functions in current process
+    """
+    parse_dating.cache_clear()
+    parse_episkop_name_in_cafedra.cache_clear()
+    estimate_date.cache_clear()
+
+
 def get_namesake_num(parsed: ParsedEpiskopInCafedra) -> int | None:
     if not parsed or isinstance(parsed, ParseFail):
         return None
@@ -196,6 +257,150 @@ def extract_notes(s) -> Tuple[str, list]:
     return s, all_notes
 
 
+# ------------ Persistent cache of parsed episkop rows -------------------
+
+
+class CachedParseError(Exception):
+    """
+    Replaces pyparsing exception in ParseFail.error of cached rows:
+    pyparsing exceptions are pickled without grammar element and their
+    message changes. Message is the same as of original exception.
+    """
+    def __str__(self):
+        return self.args[0]
+
+    def __repr__(self):
+        return self.args[0]
+
+
+class RowParseCache:
+    """
+    Sqlite cache of parse_episkop_row results (including ParseFails),
+    key is hash of row text. Cache is cleared, when grammar fingerprint
+    (sources of parsers and row parsing functions) is changed.
+
+    Cache may be used by several processes (ParallelLink workers):
+    hit and miss counters are saved in cache db too (see reset_stats()
+    and report()).
+    """
+    GrammarSources = ['parsers/dating.py', 'parsers/episkop.py',
+                      'parsers/fail.py']
+
+    def __init__(self, filename: str):
+        import sqlite3
+        self.filename = filename
+        self.db = sqlite3.connect(filename, timeout=60)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS meta '
+                            '(name TEXT PRIMARY KEY, value)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS rows '
+                            '(key BLOB PRIMARY KEY, value BLOB)')
+            self.db.execute("INSERT OR IGNORE INTO meta VALUES "
+                            "('hits', 0), ('misses', 0)")
+
+            version = self.grammar_version()
+            old = self.db.execute("SELECT value FROM meta "
+                                  "WHERE name = 'version'").fetchone()
+            if not old or old[0] != version:
+                self.db.execute('DELETE FROM rows')
+                self.db.execute("INSERT OR REPLACE INTO meta "
+                                "VALUES ('version', ?)", (version,))
+
+    @classmethod
+    def grammar_version(cls) -> str:
+        import hashlib
+        import inspect
+        import os
+
+        h = hashlib.blake2b(digest_size=16)
+        base = os.path.dirname(os.path.abspath(__file__))
+        for name in cls.GrammarSources:
+            with open(os.path.join(base, name), 'rb') as f:
+                h.update(f.read())
+        for func in (parse_episkop_row, divide_episkop_row, extract_notes,
+                     ParsedEpiskopRow):
+            h.update(inspect.getsource(func).encode('utf8'))
+        h.update(note_re.pattern.encode('utf8'))
+        return h.hexdigest()
+
+    @staticmethod
+    def row_key(row: str) -> bytes:
+        import hashlib
+        return hashlib.blake2b(row.encode('utf8'), digest_size=16).digest()
+
+    @staticmethod
+    def _dump(pp: ParsedEpiskopRow | ParseFail) -> bytes:
+        import dataclasses
+        import pickle
+
+        def fix(x):
+            if isinstance(x, ParseFail) and isinstance(x.error, Exception):
+                return dataclasses.replace(
+                    x, error=CachedParseError(str(x.error)))
+            return x
+
+        if isinstance(pp, ParsedEpiskopRow):
+            pp = dataclasses.replace(pp, begin=fix(pp.begin),
+                                     end=fix(pp.end), who=fix(pp.who))
+        return pickle.dumps(fix(pp))
+
+    def parse_rows(self, rows: set):
+        """
+        Finds rows in cache, parses and saves to cache other ones.
+        Returns function: row text -> ParsedEpiskopRow | ParseFail,
+        it returns new object on every call (parsed rows are changed
+        by CafedraArticleParser).
+        """
+        import pickle
+
+        keys = {self.row_key(r): r for r in rows}
+        found = {}
+        key_list = list(keys)
+        for i in range(0, len(key_list), 500):
+            chunk = key_list[i:i + 500]
+            found.update(self.db.execute(
+                f'SELECT key, value FROM rows WHERE key IN '
+                f'({",".join("?" * len(chunk))})', chunk))
+
+        new = [(k, self._dump(parse_episkop_row(r)))
+               for k, r in keys.items() if k not in found]
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO rows VALUES (?, ?)',
+                                new)
+            self.db.execute("UPDATE meta SET value = value + ? "
+                            "WHERE name = 'hits'", (len(found),))
+            self.db.execute("UPDATE meta SET value = value + ? "
+                            "WHERE name = 'misses'", (len(new),))
+        found.update(new)
+
+        by_row = {r: found[k] for k, r in keys.items()}
+        return lambda row: pickle.loads(by_row[row])
+
+    def reset_stats(self):
+        with self.db:
+            self.db.execute("UPDATE meta SET value = 0 "
+                            "WHERE name IN ('hits', 'misses')")
+
+    def get_stats(self) -> Tuple[int, int]:
+        """
+        returns (hits, misses) since reset_stats()
+        """
+        d = dict(self.db.execute("SELECT name, value FROM meta "
+                                 "WHERE name IN ('hits', 'misses')"))
+        return d['hits'], d['misses']
+
+    def report(self) -> str:
+        hits, misses = self.get_stats()
+        total = hits + misses
+        rate = f' ({hits / total:.1%} hits)' if total else ''
+        return f'Row parse cache: {hits} hits, {misses} misses{rate}'
+
+    def close(self):
+        self.db.close()
+
+
 class WholeRussiaCafedraFixer(ChainLink):
     def __init__(self):
         self._moscow_done = False
@@ -285,44 +490,137 @@ class UnparsedCafedraEpiskopLogger(ChainLink):
     def finish(self):
         self.stream.close()
 
+    def close(self):
+        self.stream.close()
+
 
 
 class CafedraJsonPatcher(ChainLink):
-    def __init__(self, patch_file):
-        with open(patch_file) as f:
-            p = f.read()
-            self.patches = parse_patches(p)
+    def __init__(self, patch_file, index_file: str = None):
+        """
+        index_file - disk cache of PatchIndex (file name of patch_file
+                     + '.index' in PatchIndex.IndexDir by default)
+        """
+        self.patch_file = patch_file
+        self.index = PatchIndex.load(patch_file, index_file)
+        self.used = set()
 
     def process(self, s: CafedraArticle):
-        patched = 0
-        if s.header in self.patches:
-            patch = self.patches[s.header]
-            i = 0
-            while i < len(s.episkops):
-                ep = s.episkops[i]
+        patch_count = self.index.counts.get(s.header)
+        if patch_count:
+            get_patch = self.index.patches.get
+            get_key = PatchItem._get_key
+            patched = 0
+            episkops = []
+            for ep in s.episkops:
                 if isinstance(ep, ArticleEpiskopRow):
-                    p = patch.get_patch(ep.text)
-                    if p:
+                    key = (s.header, get_key(ep.text))
+                    p = get_patch(key)
+                    if p and p[0]:
                         patched += 1
-                        if p != '#delete#':
-                            ep.text = p
-                        else:
-                            del s.episkops[i]
+                        self.used.add(key)
+                        if p[0] == '#delete#':
                             continue
-                i+=1
+                        ep.text = p[0]
+                episkops.append(ep)
+            s.episkops[:] = episkops
 
-            if patched != patch.count_patches():
-                raise Exception(f'{s.header} patched {patched}, patch count {patch.count_patches()}')
+            if patched != patch_count:
+                raise Exception(f'{s.header} patched {patched}, patch count {patch_count}')
         self.send(s)
 
+    def finish(self):
+        unused = self.unused_patches()
+        if unused:
+            print(f'Unused patches of {self.patch_file}:')
+            for line, header, action in unused:
+                print(f'  line {line}: {header}: {action}')
+
+    def unused_patches(self) -> List[Tuple[int, str, str]]:
+        """
+        returns (line number, header, patched text) of patches
+        not applied to any row
+        """
+        return sorted((line, key[0], action)
+                      for key, (action, line) in self.index.patches.items()
+                      if key not in self.used)
+
+
+class PatchIndex:
+    """
+    Compiled patches of episkop rows:
+    patches - (header, row key) -> (patched text or '#delete#', line number
+              of patch in patch file), key is PatchItem._get_key of row
+    counts - header -> count of patches of cafedra
+
+    Index is saved to disk (pickle) with mtime and hash of patch file,
+    it is parsed again only when patch file content is changed.
+    """
+    Version = 1
+    # index files are runtime data, they are kept out of data/patch
+    IndexDir = 'data'
+
+    def __init__(self, patches: dict, counts: dict):
+        self.patches = patches
+        self.counts = counts
+
+    @classmethod
+    def from_text(cls, text: str) -> 'PatchIndex':
+        patches = {}
+        counts = {}
+        for header, item in parse_patches(text).items():
+            counts[header] = item.count_patches()
+            for key, action in item.patches.items():
+                patches[(header, key)] = (action, item.lines[key])
+        return cls(patches, counts)
+
+    @classmethod
+    def load(cls, patch_file: str, index_file: str = None) -> 'PatchIndex':
+        import hashlib
+        import os
+        import pickle
+
+        index_file = index_file or os.path.join(
+            cls.IndexDir, os.path.basename(patch_file) + '.index')
+        mtime = os.stat(patch_file).st_mtime_ns
+
+        try:
+            with open(index_file, 'rb') as f:
+                cached = pickle.load(f)
+            if cached['version'] != cls.Version:
+                cached = None
+        except (OSError, EOFError, KeyError, pickle.UnpicklingError):
+            cached = None
+        if cached and cached['mtime'] == mtime:
+            return cls(cached['patches'], cached['counts'])
+
+        with open(patch_file, 'rb') as f:
+            data = f.read()
+        digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+        if cached and cached['hash'] == digest:
+            index = cls(cached['patches'], cached['counts'])
+        else:
+            # universal newlines as in text mode open()
+            text = data.decode('utf8').replace('\r\n', '\n') \
+                                      .replace('\r', '\n')
+            index = cls.from_text(text)
+
+        tmp = index_file + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump({'version': cls.Version, 'mtime': mtime,
+                         'hash': digest, 'patches': index.patches,
+                         'counts': index.counts}, f)
+        os.replace(tmp, index_file)
+        return index
+
 
 def parse_patches(p: str):
-    p = [x for x in p.split('\n') if x]
+    p = [(i, x) for i, x in enumerate(p.split('\n'), 1) if x]
     res = {}
 
     cur_patch = None
     prev_line_data = None
-    for l in p:
+    for line, l in p:
         cmd, data = split_patch_line(l)
         if cmd == '#header#':
             if cur_patch:
@@ -330,11 +628,11 @@ def parse_patches(p: str):
             cur_patch = PatchItem(data)
         elif cmd == '#fixed#':
             assert cur_patch is not None
-            cur_patch.add(data, data)
+            cur_patch.add(data, data, line)
         elif cmd == '#join prev#':
             assert prev_line_data is not None
-            cur_patch.add(prev_line_data, prev_line_data.strip() + ' ' + data.strip())
-            cur_patch.add(data, '#delete#')
+            cur_patch.add(prev_line_data, prev_line_data.strip() + ' ' + data.strip(), line)
+            cur_patch.add(data, '#delete#', line)
         elif cmd == '#unparsed#':
             # Необработанные проблемы - слово unparsed ещё не заменили на правильную команду
             continue
@@ -352,10 +650,12 @@ class PatchItem:
     def __init__(self, name):
         self.name = name
         self.patches = {}
+        self.lines = {}  # line numbers of patches in patch file
 
-    def add(self, for_data, patched_data):
+    def add(self, for_data, patched_data, line=None):
         key = self._get_key(for_data)
         self.patches[key] = patched_data
+        self.lines[key] = line
 
     def get_patch(self, for_data):
         key = self._get_key(for_data)
@@ -366,7 +666,7 @@ class PatchItem:
 
     @staticmethod
     def _get_key(for_data):
-        return re.sub(f'[^a-zA-ZА-Яа-я0-9]', '', for_data)
+        return _patch_key_re.sub('', for_data)
 
     def __repr__(self):
         import json
@@ -376,6 +676,9 @@ class PatchItem:
         return repr(self)
 
 
+_patch_key_re = re.compile('[^a-zA-ZА-Яа-я0-9]')
+
+
 def split_patch_line(l):
     m = re.match(r'(#[a-zA-Z ]+#)(.*)', l)
     if m:
@@ -402,6 +705,76 @@ class EpiskopRowsSaver(ChainLink):
                 f.write(r + '\n')
 
 
+def compare_dating_parsers(rows: List[str]) -> int:
+    """
+    Differential test of parse_dating_fast and parse_dating_pyparsing
+    on begin/end datings of episkop rows. Returns count of mismatches.
+    """
+    datings = []
+    for div in divided_rows(rows):
+        datings += [d for d in div[:2] if d]
+    return compare_parsers('Datings', datings,
+                           parse_dating_fast, parse_dating_pyparsing)
+
+
+def compare_episkop_name_parsers(rows: List[str]) -> int:
+    """
+    Differential test of parse_episkop_name_fast and
+    parse_episkop_name_pyparsing on "who" column of episkop rows.
+    Returns count of mismatches.
+    """
+    names = [div[2] for div in divided_rows(rows)]
+    return compare_parsers('Names', names, parse_episkop_name_fast,
+                           parse_episkop_name_pyparsing)
+
+
+def divided_rows(rows: List[str]):
+    for r in rows:
+        div = divide_episkop_row(extract_notes(r)[0])
+        if not isinstance(div, ParseFail):
+            yield div
+
+
+def compare_parsers(title: str, texts: List[str], fast, slow) -> int:
+    """
+    Compares fast path parser (returns None for texts it can't parse)
+    with pyparsing one: prints mismatches, part of texts parsed by fast
+    path and speedup of fast path with pyparsing fallback (as in
+    memoized parse functions, but without lru cache) relative to
+    pyparsing. Returns count of mismatches.
+    """
+    import time
+
+    mismatches = 0
+    fast_cnt = 0
+    for t in texts:
+        p = fast(t)
+        if p is None:
+            continue
+        fast_cnt += 1
+        expected = slow(t)
+        if p != expected:
+            mismatches += 1
+            print(f'Mismatch for {t!r}:\n  fast:      {p}\n'
+                  f'  pyparsing: {expected}')
+
+    def measure(parse):
+        start = time.perf_counter()
+        for t in texts:
+            parse(t)
+        return time.perf_counter() - start
+
+    t_slow = measure(slow)
+    t_fast = measure(lambda t: fast(t) or slow(t))
+    part = fast_cnt / len(texts) if texts else 0
+    print(f'{title}: {len(texts)}, fast path: {fast_cnt} ({part:.1%}), '
+          f'mismatches: {mismatches}')
+    print(f'pyparsing {t_slow:.3f} s ({len(texts) / t_slow:.0f}/s), '
+          f'fast path + pyparsing {t_fast:.3f} s '
+          f'({len(texts) / t_fast:.0f}/s), speedup x{t_slow / t_fast:.1f}')
+    return mismatches
+
+
 if __name__ == '__main__':
     from book_parser import CafedraArticlesFromJson
     import sys
@@ -416,6 +789,15 @@ if __name__ == '__main__':
         print(f'Total episkop rows: {len(rs.rows)}')
         sys.exit(0)
 
+    if 'dating' in sys.argv or 'names' in sys.argv:
+        # Rows are saved by rows mode
+        rows = open(f, encoding='utf-8').read().split('\n')
+        if 'dating' in sys.argv:
+            mismatches = compare_dating_parsers(rows)
+        else:
+            mismatches = compare_episkop_name_parsers(rows)
+        sys.exit(1 if mismatches else 0)
+
     test = '''
 31.10.1859	–	09.11.1866	–	Антоний Амфитеатров
 (01.10.1917	–	10(23)11.1921	–	Давид Качахидзе)
@@ -486,10 +868,12 @@ if __name__ == '__main__':
                     print(p.error)
                     print('------------\n')
                     fail_cnt += 1
-            elif p.has_fails():
+            elif p.error:
                 print(s)
                 print('!!!!!', p)
                 print('------------\n')
                 fail_cnt += 1
 
     print("Total", len(test), "Failed", fail_cnt, "Skipped", skip_cnt)
+    for name, info in parse_cache_stats().items():
+        print(f'{name}: {info}')
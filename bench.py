@@ -0,0 +1,872 @@
+"""
+Benchmarks of book processing chains.
+
+Run: python bench.py <mode> [times]
+where times - how many times data/sample_cafedry.xml is repeated
+to get large input (default 200).
+
+modes:
+* batch - chain of book_parser.py links with and without batches
+* xml - XmlSax vs XmlExpat
+* articles - time and peak RSS of book_parser.py articles chain
+             (without signal patches), run it in fresh process
+* machine - StateMachine vs CompiledStateMachine in CafedraArticleBuilder
+            on recorded signals, TransitionTracer overhead and check
+            of replay of wrapped trace (see check_wrapped_trace_replay)
+* replay - articles from xml vs articles from binary signal dump
+           (SignalBinarySaver / SignalReplay), with dump size
+* incremental - full build of articles json vs CafedraArticlesIncrementalBuild
+                after typo fix in one cafedra and after signal patch
+                deleting header, with equality check
+* parallel - articles json by sequential chain vs CafedraXmlSplitter +
+             ParallelLink(CafedraSpanArticleBuilder), with equality check
+             (first cafedra is changed to no_text_cafedras case, signal
+             patches move headers, see header_patches)
+* json - reading of articles json: whole file json.load vs streaming
+         CafedraArticlesFromJson for json array and JSON Lines:
+         time to first article, total time, peak traced memory;
+         check that Chain.iter stopped early and failed Chain.process
+         leave no threads
+* text - RusTextNormalizer vs replace_u2028 + EngInRusWordsTextPreprocessor
+         on signal texts, with equivalence check. Signals are read from
+         signal dump file (python bench.py text data/cafedra_signals.txt)
+         or got from scaled data/sample_cafedry.xml
+* db - import of parsed cafedras into sqlite db by
+       CafedraDbImporter in ThreadedLink: upsert_cafedra() for every
+       cafedra vs bulk import (PeeweeBulkCafedraImport), with equality
+       of tables read from main thread after import and check of
+       foreign keys in bulk import
+* parser - parsers of episkop rows on rows corpus (saved by
+           python article_parser.py rows): divide_episkop_row,
+           parse_dating, parse_episkop_name_in_cafedra and
+           parse_episkop_row (without lru caches)
+           - rows/s, p50/p99 latency, fails by code;
+           parse_episkop_row results are compared with golden snapshot
+           (data/episkop_rows_golden.jsonl for data/episkop_rows.txt).
+           Run: python bench.py parser [rows_file] [parallel] [update]
+           parallel - parsing in ParallelLink, update - save results
+           as new golden snapshot (run fails if there is no snapshot)
+"""
+from chain import Chain, ChainLink, Collector, XmlSax, XmlExpat
+from book_parser import CafedraSignaller, cafedra_signal_chain, \
+                        CafedraArticleBuilder, \
+                        SignalSaver, CafedraArticlesToJsonFile, \
+                        Signal, replace_u2028, SignalBinarySaver, \
+                        SignalReplay, CafedraArticlesIncrementalBuild, \
+                        CafedraArticlesFromJson, CafedraXmlSplitter, \
+                        CafedraSpanArticleBuilder
+from chain import ParallelLink, ThreadedLink
+from models import CafedraArticle
+from article_parser import parse_episkop_row, divide_episkop_row, \
+                           extract_notes, clear_parse_caches
+from parsers.dating import parse_dating
+from parsers.episkop import parse_episkop_name_in_cafedra
+from parsers.fail import ParseFail
+from lib.rus_eng_letters_confusion import EngInRusWordsTextPreprocessor, \
+                                          RusTextNormalizer
+
+from state_machine import StateMachine, TransitionTracer
+
+import dataclasses
+import functools
+import json
+import os
+import resource
+import tempfile
+import threading
+import time
+import tracemalloc
+
+
+SampleXml = 'data/sample_cafedry.xml'
+
+
+def scaled_sample_xml(times: int) -> str:
+    """
+    returns data/sample_cafedry.xml with content of <Story> repeated
+    given number of times
+    """
+    xml = open(SampleXml, encoding='utf8').read()
+    start = xml.index('>', xml.index('<Story ')) + 1
+    end = xml.index('</Story>')
+    return xml[:start] + xml[start:end] * times + xml[end:]
+
+
+def measure(title: str, func, repeat: int = 3) -> float:
+    """
+    prints and returns best time of func() call
+    """
+    best = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        func()
+        t = time.perf_counter() - t
+        best = t if best is None else min(best, t)
+    print(f'{title:46} {best:8.3f} s')
+    return best
+
+
+class Counter(ChainLink):
+    def __init__(self):
+        self.count = 0
+
+    def process(self, data):
+        self.count += 1
+
+    def process_batch(self, items):
+        self.count += len(items)
+
+
+def signal_chain(first: ChainLink) -> Chain:
+    return cafedra_signal_chain(first) \
+        .add(CafedraArticleBuilder()) \
+        .add(Counter())
+
+
+def bench_batch(xml: str):
+    def run(batch_size):
+        def f():
+            signal_chain(XmlSax(batch_size=batch_size)).process(xml)
+        return f
+
+    single = measure('XmlSax -> CafedraArticleBuilder, single', run(None))
+    for size in (100, 1000, 10000):
+        t = measure(f'XmlSax -> CafedraArticleBuilder, batch {size}',
+                    run(size))
+        print(f'{"":46} speedup x{single / t:.2f}')
+
+
+def bench_xml(xml: str):
+    a, b = Collector(), Collector()
+    Chain(XmlSax()).add(a).process(xml)
+    Chain(XmlExpat()).add(b).process(xml)
+    print('Equal SaxItem streams:', a.items == b.items)
+
+    def run(source):
+        def f():
+            Chain(source()).add(Counter()).process(xml)
+        return f
+
+    sax_time = measure('XmlSax', run(lambda: XmlSax(batch_size=1000)))
+    for title, source in (
+        ('XmlExpat', lambda: XmlExpat(batch_size=1000)),
+        ('XmlExpat, buffer_text', lambda: XmlExpat(batch_size=1000,
+                                                   buffer_text=True)),
+    ):
+        t = measure(title, run(source))
+        print(f'{"":46} speedup x{sax_time / t:.2f}')
+
+    sax_time = measure('XmlSax -> CafedraArticleBuilder',
+                       lambda: signal_chain(XmlSax(batch_size=1000))
+                       .process(xml))
+    t = measure('XmlExpat -> CafedraArticleBuilder',
+                lambda: signal_chain(XmlExpat(batch_size=1000)).process(xml))
+    print(f'{"":46} speedup x{sax_time / t:.2f}')
+
+
+def bench_articles(xml: str):
+    with tempfile.TemporaryDirectory() as tmp:
+        xml_file = os.path.join(tmp, 'book.xml')
+        with open(xml_file, 'w', encoding='utf8') as f:
+            f.write(xml)
+        del xml
+
+        t = time.perf_counter()
+        with open(xml_file, encoding='utf8') as f:
+            cafedra_signal_chain(
+                XmlExpat(batch_size=1000),
+                savers=[SignalSaver(os.path.join(tmp, 'signals.txt'))]) \
+                .add(CafedraArticleBuilder()) \
+                .add(CafedraArticlesToJsonFile(os.path.join(tmp,
+                                                            'articles.json'))) \
+                .process(f)
+        t = time.perf_counter() - t
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f'{"book_parser.py articles chain":46} {t:8.3f} s')
+    print(f'{"Peak RSS":46} {rss:8.1f} MB')
+
+
+def bench_machine(xml: str):
+    signals = Collector()
+    cafedra_signal_chain(XmlExpat(batch_size=1000)) \
+        .add(signals) \
+        .process(xml)
+    signals = signals.items
+    print(f'Recorded signals: {len(signals)}')
+
+    def run(compiled, out=None):
+        def f():
+            builder = CafedraArticleBuilder()
+            if not compiled:
+                builder.machine = StateMachine(builder.states,
+                                               'expect_header', builder)
+            Chain(builder).add(out or Counter()).process_batch(signals)
+        return f
+
+    a, b = Collector(), Collector()
+    run(False, a)()
+    run(True, b)()
+    print('Equal articles:',
+          [x.data for x in a.items] == [x.data for x in b.items])
+
+    t = measure('StateMachine', run(False))
+    t2 = measure('CompiledStateMachine', run(True))
+    print(f'{"":46} speedup x{t / t2:.2f}')
+
+    def traced():
+        builder = CafedraArticleBuilder(trace_size=1000, trace_file=None)
+        Chain(builder).add(Counter()).process_batch(signals)
+
+    t3 = measure('CompiledStateMachine, TransitionTracer', traced)
+    print(f'{"":46} overhead x{t3 / t2:.2f}')
+
+    print('Replay of wrapped trace reaches recorded error:',
+          check_wrapped_trace_replay(signals))
+
+
+def check_wrapped_trace_replay(signals: list) -> bool:
+    """
+    Breaks episkop signal of third article from the end, builds
+    articles with trace smaller than signals of book (ring buffer wraps,
+    trace starts in the middle of article) and replays saved trace:
+    replay must fail at the same broken signal
+    """
+    import contextlib
+    import io
+
+    heads = [i for i, s in enumerate(signals)
+             if s.name in ('header', 'header_obn')]
+    broken = [i for i in range(heads[-3], len(signals))
+              if signals[i].name == 'episkop'][1]
+    signals = list(signals)
+    s = signals[broken]
+    signals[broken] = Signal('note', s.data, s.line)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        trace_file = os.path.join(tmp, 'trace.jsonl')
+        errors = []
+        for replay in (False, True):
+            try:
+                # printed articles and warnings of state_machine logger
+                with contextlib.redirect_stdout(io.StringIO()), \
+                        contextlib.redirect_stderr(io.StringIO()):
+                    if replay:
+                        CafedraArticleBuilder.replay_trace(trace_file)
+                    else:
+                        builder = CafedraArticleBuilder(
+                            trace_size=40, trace_file=trace_file)
+                        Chain(builder).add(Counter()).process_batch(signals)
+            except Exception as ex:
+                errors.append(f'{type(ex).__name__}: {ex}')
+            else:
+                errors.append(None)
+
+        transitions = TransitionTracer.load(trace_file)
+
+    first_header = next(t for t in transitions
+                        if t.signal in ('header', 'header_obn'))
+    assert first_header.old_state != 'expect_header', \
+        'trace must start in the middle of book'
+    return errors[0] is not None and errors[0] == errors[1]
+
+
+def bench_replay(xml: str):
+    with tempfile.TemporaryDirectory() as tmp:
+        txt_file = os.path.join(tmp, 'signals.txt')
+        bin_file = os.path.join(tmp, 'signals.bin')
+        Chain(XmlExpat(batch_size=1000)) \
+            .add(CafedraSignaller()) \
+            .add(SignalSaver(txt_file)) \
+            .add(SignalBinarySaver(bin_file)) \
+            .process(xml)
+        print(f'{"Text dump":46} {os.path.getsize(txt_file) / 1024:8.1f} kB')
+        print(f'{"Binary dump":46} {os.path.getsize(bin_file) / 1024:8.1f} kB')
+
+        def articles(source, data):
+            out = Collector()
+            cafedra_signal_chain(source) \
+                .add(CafedraArticleBuilder()) \
+                .add(out) \
+                .process(data)
+            return [a.data for a in out.items]
+
+        a = articles(XmlExpat(batch_size=1000), xml)
+        b = articles(SignalReplay(batch_size=1000), bin_file)
+        print('Equal articles:', a == b)
+
+        t = measure('xml -> articles',
+                    lambda: articles(XmlExpat(batch_size=1000), xml))
+        t2 = measure('SignalReplay -> articles',
+                     lambda: articles(SignalReplay(batch_size=1000),
+                                      bin_file))
+        print(f'{"":46} speedup x{t / t2:.2f}')
+        measure('SignalReplay, read only',
+                lambda: Chain(SignalReplay(batch_size=1000))
+                .add(Counter()).process(bin_file))
+
+
+def bench_incremental(xml: str):
+    with tempfile.TemporaryDirectory() as tmp:
+        xml_file = os.path.join(tmp, 'book.xml')
+        full_json = os.path.join(tmp, 'full.json')
+        inc_json = os.path.join(tmp, 'inc.json')
+        patches = {}
+
+        def full():
+            with open(xml_file, encoding='utf8') as f:
+                cafedra_signal_chain(XmlExpat(batch_size=1000), patches) \
+                    .add(CafedraArticleBuilder()) \
+                    .add(CafedraArticlesToJsonFile(full_json)) \
+                    .process(f)
+
+        def incremental():
+            inc = CafedraArticlesIncrementalBuild(inc_json, patches=patches)
+            inc.build(xml_file)
+            return inc
+
+        def check(title, edit=None):
+            if edit:
+                with open(xml_file, 'w', encoding='utf8') as f:
+                    f.write(edit)
+            measure(f'{title}: full', full, repeat=1)
+            t2 = time.perf_counter()
+            inc = incremental()
+            t2 = time.perf_counter() - t2
+            print(f'{title + ": incremental":46} {t2:8.3f} s, '
+                  f'rebuilt {inc.rebuilt} of {inc.total} spans')
+            with open(full_json, encoding='utf8') as a, \
+                    open(inc_json, encoding='utf8') as b:
+                print(f'{"":46} equal json: {a.read() == b.read()}')
+
+        check('first build', xml)
+        check('no changes')
+        pos = xml.index('Тыва', len(xml) // 2)
+        check('typo fix', xml[:pos] + 'Тува' + xml[pos + 4:])
+        xml = xml[:pos] + 'Тува\n' + xml[pos + 4:]
+        check('new line', xml)
+        # deleted header ends article of previous span later
+        skip = [(line, p) for line, p in header_patches(xml).items()
+                if p[1] == 'SKIP!']
+        line, patch = skip[len(skip) // 2]
+        patches[line] = patch
+        check('header patch')
+
+
+def no_text_cafedra_xml(xml: str) -> str:
+    """
+    first cafedra of xml without text, with header from
+    CafedraArticleBuilder.no_text_cafedras
+    """
+    header = CafedraArticleBuilder.no_text_cafedras[0]
+    xml = xml.replace('<Content>АБАКАНСКАЯ</Content>',
+                      f'<Content>{header}</Content>', 1)
+    text = xml.index('<ParagraphStyleRange AppliedParagraphStyle='
+                     '"ParagraphStyle/Текст">')
+    text_end = xml.index('</ParagraphStyleRange>', text) \
+        + len('</ParagraphStyleRange>')
+    # keep line numbers
+    return xml[:text] + '\n' * xml.count('\n', text, text_end) \
+        + xml[text_end:]
+
+
+def header_patches(xml: str) -> dict:
+    """
+    signal patches, which move cafedra headers away from header
+    paragraphs: in paragraphs with several headers first header is
+    deleted and next one is edited
+    """
+    signals = Collector()
+    Chain(XmlExpat(batch_size=1000)).add(CafedraSignaller()) \
+        .add(signals).process(xml)
+    names = [s.name for s in signals.items]
+    patches = {}
+    for i, s in enumerate(signals.items[:-2]):
+        if names[i:i + 3] == ['header', 'br', 'header']:
+            second = signals.items[i + 2]
+            patches[s.line] = ('', 'SKIP!')
+            patches[second.line] = (f'{second.data}===>{second.data} ',
+                                    'EDIT!')
+    return patches
+
+
+def bench_parallel(xml: str):
+    xml = no_text_cafedra_xml(xml)
+    patches = header_patches(xml)
+    print(f'Signal patches of headers: {len(patches)}')
+    workers = os.cpu_count()
+    with tempfile.TemporaryDirectory() as tmp:
+        xml_file = os.path.join(tmp, 'book.xml')
+        with open(xml_file, 'w', encoding='utf8') as f:
+            f.write(xml)
+        seq_json = os.path.join(tmp, 'seq.json')
+        par_json = os.path.join(tmp, 'par.json')
+
+        def sequential():
+            with open(xml_file, encoding='utf8') as f:
+                cafedra_signal_chain(XmlExpat(batch_size=1000), patches) \
+                    .add(CafedraArticleBuilder()) \
+                    .add(CafedraArticlesToJsonFile(seq_json)) \
+                    .process(f)
+
+        def parallel():
+            Chain(CafedraXmlSplitter(copy_text=True)) \
+                .add(ParallelLink(functools.partial(
+                    CafedraSpanArticleBuilder, patches), workers,
+                    chunk=20)) \
+                .add(CafedraArticlesToJsonFile(par_json)) \
+                .process(xml_file)
+
+        t = measure('sequential', sequential)
+        t2 = measure(f'parallel, {workers} workers', parallel)
+        print(f'{"":46} speedup x{t / t2:.2f}')
+        with open(seq_json, encoding='utf8') as a, \
+                open(par_json, encoding='utf8') as b:
+            seq = a.read()
+            print('Equal json:', seq == b.read())
+            print('no_text_cafedras article:',
+                  CafedraArticleBuilder.no_text_cafedras[0] in seq)
+
+
+def bench_json(xml: str):
+    with tempfile.TemporaryDirectory() as tmp:
+        files = {}
+        for ext in ('json', 'jsonl'):
+            files[ext] = os.path.join(tmp, 'articles.' + ext)
+            cafedra_signal_chain(XmlExpat(batch_size=1000)) \
+                .add(CafedraArticleBuilder()) \
+                .add(CafedraArticlesToJsonFile(files[ext])) \
+                .process(xml)
+            print(f'{ext + " file":46} '
+                  f'{os.path.getsize(files[ext]) / 2**20:8.1f} MB')
+        del xml
+
+        def load_whole(json_file):
+            with open(json_file, encoding='utf8') as f:
+                yield from [CafedraArticle.from_dict(d)
+                            for d in json.load(f)]
+
+        for title, read, json_file in (
+            ('json.load', load_whole, files['json']),
+            ('streaming json', CafedraArticlesFromJson.iter_parsed_book,
+             files['json']),
+            ('streaming jsonl', CafedraArticlesFromJson.iter_parsed_book,
+             files['jsonl']),
+        ):
+            tracemalloc.start()
+            t = time.perf_counter()
+            articles = read(json_file)
+            next(articles)
+            first = time.perf_counter() - t
+            for _ in articles:
+                pass
+            t = time.perf_counter() - t
+            peak = tracemalloc.get_traced_memory()[1] / 2**20
+            tracemalloc.stop()
+            print(f'{title:46} first {first:8.3f} s, all {t:8.3f} s, '
+                  f'peak {peak:8.1f} MB')
+
+        print('Chain.iter stopped early leaves no threads and processes:',
+              check_iter_early_stop())
+        print('Failed Chain.process leaves no threads and processes:',
+              check_failed_run())
+
+
+class _PassLink(ChainLink):
+    def process(self, data):
+        self.send(data)
+
+
+class _CountLink(ChainLink):
+    def process(self, n: int):
+        for i in range(n):
+            self.send(i)
+
+
+class _FailLink(ChainLink):
+    def process(self, data):
+        if data == 100:
+            raise ValueError('test error')
+
+
+def check_failed_run() -> bool:
+    """
+    Last link fails in Chain.process() with ThreadedLink and ParallelLink:
+    worker thread and worker processes must be stopped
+    """
+    import multiprocessing
+
+    threads = threading.active_count()
+    chain = Chain(_CountLink()) \
+        .add(ParallelLink(_PassLink, workers=2, chunk=5)) \
+        .add(ThreadedLink(_FailLink(), queue_size=2))
+    try:
+        chain.process(10**4)
+        return False
+    except ValueError:
+        pass
+    return threading.active_count() == threads \
+        and not multiprocessing.active_children()
+
+
+def check_iter_early_stop() -> bool:
+    """
+    Takes first items from Chain.iter() with ThreadedLink and ParallelLink
+    and closes iterator: worker thread and worker processes must be
+    stopped
+    """
+    import multiprocessing
+
+    threads = threading.active_count()
+    chain = Chain(_CountLink()).add(ThreadedLink(_PassLink(), queue_size=2)) \
+        .add(ParallelLink(_PassLink, workers=2, chunk=5))
+    items = chain.iter(10**6, queue_size=2)
+    for _ in range(3):
+        next(items)
+    ok = threading.active_count() > threads
+    items.close()
+    return ok and threading.active_count() == threads \
+        and not multiprocessing.active_children()
+
+
+def bench_text(texts):
+    def old(replace_single):
+        fixer = EngInRusWordsTextPreprocessor().process
+
+        def f():
+            res = []
+            for t in texts:
+                if t:
+                    if '\u2028' in t:
+                        t = replace_u2028(t)
+                    t = fixer(t, replace_single=replace_single)
+                res.append(t)
+            return res
+        return f
+
+    def new(replace_single):
+        def f():
+            n = RusTextNormalizer(replace_single=replace_single)
+            return n.normalize_batch(texts)
+        return f
+
+    def new_no_cache(replace_single):
+        def f():
+            n = RusTextNormalizer(replace_single=replace_single,
+                                  cache_size=0)
+            return n.normalize_batch(texts)
+        return f
+
+    for replace_single in (False, True):
+        print(f'replace_single={replace_single}, equal texts:',
+              old(replace_single)() == new(replace_single)())
+
+    n = RusTextNormalizer()
+    n.normalize_batch(texts)
+    print(n.cache_info())
+
+    t = measure('replace_u2028 + EngInRusWordsTextPreprocessor', old(False))
+    for title, f in (('RusTextNormalizer, no cache', new_no_cache(False)),
+                     ('RusTextNormalizer', new(False))):
+        t2 = measure(title, f)
+        print(f'{"":46} speedup x{t / t2:.2f}')
+
+
+def signal_texts(xml: str):
+    signals = Collector()
+    Chain(XmlExpat(batch_size=1000)) \
+        .add(CafedraSignaller()) \
+        .add(signals) \
+        .process(xml)
+    return [s.data for s in signals.items]
+
+
+def dump_texts(filename: str):
+    """
+    texts of signals from SignalSaver file
+    (\\u2028 is not line separator here, so splitlines() is not used)
+    """
+    with open(filename, encoding='utf8', newline='') as f:
+        lines = f.read().split('\n')
+    return [Signal.deserialize(line).data for line in lines if line]
+
+
+def bench_db(xml: str):
+    import contextlib
+    import copy
+    import io
+    from article_parser import CafedraArticleParser
+    from db import get_db, PeeweeHistHierarhStorage, CafedraDbImporter
+    from models import HierarhOrmModels
+
+    cafedras = Collector()
+    with tempfile.TemporaryDirectory() as tmp:
+        json_file = os.path.join(tmp, 'articles.json')
+        cafedra_signal_chain(XmlExpat(batch_size=1000)) \
+            .add(CafedraArticleBuilder()) \
+            .add(CafedraArticlesToJsonFile(json_file)) \
+            .process(xml)
+        with contextlib.redirect_stdout(io.StringIO()):  # human messages
+            Chain(CafedraArticlesFromJson(batch_size=100)) \
+                .add(CafedraArticleParser()) \
+                .add(cafedras) \
+                .process(json_file)
+    print(f'Cafedras: {len(cafedras.items)}')
+
+    tables = []
+    times = []
+    for title, bulk in (('CafedraDbImporter, upsert_cafedra', False),
+                        ('CafedraDbImporter, bulk import', True)):
+        items = copy.deepcopy(cafedras.items)
+        with tempfile.TemporaryDirectory() as tmp:
+            db = get_db(os.path.join(tmp, 'hierarh.sqlite3'))
+            with db.bind_ctx(HierarhOrmModels):
+                db.create_tables(HierarhOrmModels)
+
+                # importer works in other thread as in db.py build,
+                # tables are read in this thread after import
+                t = time.perf_counter()
+                Chain(ThreadedLink(
+                    CafedraDbImporter(PeeweeHistHierarhStorage(), bulk))) \
+                    .process_batch(items)
+                t = time.perf_counter() - t
+
+                tables.append([list(m.select().order_by(m.id).tuples())
+                               for m in HierarhOrmModels])
+            db.close()
+        print(f'{title:46} {t:8.3f} s')
+        times.append(t)
+
+    print(f'{"":46} speedup x{times[0] / times[1]:.2f}')
+    print('Equal tables:', tables[0] == tables[1],
+          [len(x) for x in tables[1]])
+    print('Bulk import rejects orphan rows:', check_bulk_foreign_keys())
+
+
+def check_bulk_foreign_keys() -> bool:
+    """
+    Note of not existing cafedra must fail commit of bulk import
+    (foreign keys are on, their check is deferred to commit)
+    """
+    from peewee import IntegrityError
+    from db import get_db, PeeweeHistHierarhStorage
+    from models import HierarhOrmModels, NoteOrm
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = get_db(os.path.join(tmp, 'hierarh.sqlite3'))
+        with db.bind_ctx(HierarhOrmModels):
+            db.create_tables(HierarhOrmModels)
+            bulk = PeeweeHistHierarhStorage().bulk_import()
+            bulk.begin()
+            bulk._buf[NoteOrm].append(dict(id=1, text='', cafedra_id=1))
+            try:
+                bulk.commit()
+                ok = False
+            except IntegrityError:
+                ok = True
+            ok = ok and not NoteOrm.select().count()
+        db.close()
+    return ok
+
+
+# -------------- Parsers of episkop rows ------------------------------
+EpiskopRows = 'data/episkop_rows.txt'
+
+
+def divide_row(row: str):
+    return divide_episkop_row(extract_notes(row)[0])
+
+
+# memoized parsers are measured without lru cache
+ParserStages = {
+    'divide': divide_row,
+    'dating': parse_dating.__wrapped__,
+    'name': parse_episkop_name_in_cafedra.__wrapped__,
+    'row': parse_episkop_row,
+}
+
+
+def to_plain(x):
+    """
+    parse result as json compatible data (exceptions as strings)
+    """
+    if dataclasses.is_dataclass(x):
+        return {f.name: to_plain(getattr(x, f.name))
+                for f in dataclasses.fields(x)}
+    if isinstance(x, (list, tuple)):
+        return [to_plain(i) for i in x]
+    if x is None or isinstance(x, (str, int, float, bool)):
+        return x
+    return str(x)
+
+
+def fail_code(p) -> str | None:
+    if isinstance(p, ParseFail):
+        return p.code
+    error = getattr(p, 'error', None)  # ParsedEpiskopRow
+    return error.code if error else None
+
+
+class ParserTimer(ChainLink):
+    """
+    Parses texts by parser of stage, sends
+    (text, plain result, fail code, latency in ns) for every text
+    """
+    def __init__(self, stage: str):
+        self.parse = ParserStages[stage]
+        # parse_episkop_row calls memoized parsers: without clearing
+        # repeated datings and names would be measured as cache hits
+        self.clear = clear_parse_caches if stage == 'row' else None
+
+    def process(self, text):
+        if self.clear:
+            self.clear()
+        t = time.perf_counter_ns()
+        p = self.parse(text)
+        t = time.perf_counter_ns() - t
+        self.send((text, to_plain(p), fail_code(p), t))
+
+
+def percentile(values: list, q: float):
+    """
+    q-th percentile of sorted values (nearest rank)
+    """
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def run_parser_stage(stage: str, texts: list, parallel: bool) -> list:
+    out = Collector()
+    if parallel:
+        first = ParallelLink(functools.partial(ParserTimer, stage),
+                             chunk=200)
+    else:
+        first = ParserTimer(stage)
+    t = time.perf_counter()
+    Chain(first).add(out).process_batch(texts)
+    t = time.perf_counter() - t
+
+    latencies = sorted(r[3] for r in out.items) or [0]
+    fails = {}
+    for r in out.items:
+        if r[2]:
+            fails[r[2]] = fails.get(r[2], 0) + 1
+    fails = ', '.join(f'{code} {n}' for code, n in sorted(fails.items()))
+    print(f'{stage:8} {len(texts):8} {len(texts) / t:10.0f} '
+          f'{percentile(latencies, 0.5) / 1000:9.1f} '
+          f'{percentile(latencies, 0.99) / 1000:9.1f}   {fails or "-"}')
+    return out.items
+
+
+def compare_with_golden(results: dict, golden_file: str,
+                        show: int = 10) -> int:
+    """
+    prints differences of results {row: plain result} with golden
+    snapshot, returns count of changed, new and missing rows
+    """
+    with open(golden_file, encoding='utf8') as f:
+        golden = {}
+        for line in f:
+            item = json.loads(line)
+            golden[item['row']] = item['result']
+
+    changed = [r for r in results if r in golden and results[r] != golden[r]]
+    new = [r for r in results if r not in golden]
+    missing = [r for r in golden if r not in results]
+
+    for r in changed[:show]:
+        print(f'Changed: {r}\n  golden: {golden[r]}\n  now:    {results[r]}')
+    for title, rows in (('New', new), ('Missing', missing)):
+        for r in rows[:show]:
+            print(f'{title}: {r}')
+    print(f'Golden {golden_file}: {len(golden)} rows, changed {len(changed)},'
+          f' new {len(new)}, missing {len(missing)}')
+    return len(changed) + len(new) + len(missing)
+
+
+def save_golden(results: dict, golden_file: str):
+    with open(golden_file, 'w', encoding='utf8') as f:
+        for r in sorted(results):
+            f.write(json.dumps({'row': r, 'result': results[r]},
+                               ensure_ascii=False) + '\n')
+    print(f'Golden snapshot saved to {golden_file}: {len(results)} rows')
+
+
+def bench_parser(rows_file: str, parallel: bool = False,
+                 update: bool = False) -> int:
+    """
+    returns count of differences with golden snapshot
+    """
+    with open(rows_file, encoding='utf8') as f:
+        rows = [r for r in f.read().split('\n') if r.strip()]
+    divided = [d for d in map(divide_row, rows)
+               if not isinstance(d, ParseFail)]
+    texts = {
+        'divide': rows,
+        'dating': [d for div in divided for d in div[:2] if d],
+        'name': [div[2] for div in divided],
+        'row': rows,
+    }
+
+    print(f'Input: {rows_file}, {len(rows)} rows'
+          f'{", parallel" if parallel else ""}')
+    print(f'{"stage":8} {"items":>8} {"items/s":>10} {"p50 us":>9} '
+          f'{"p99 us":>9}   fails')
+    results = {}
+    for stage in ParserStages:
+        items = run_parser_stage(stage, texts[stage], parallel)
+        if stage == 'row':
+            results = {r[0]: r[1] for r in items}
+
+    golden_file = os.path.splitext(rows_file)[0] + '_golden.jsonl'
+    if update:
+        save_golden(results, golden_file)
+        return 0
+    if not os.path.exists(golden_file):
+        print(f'No golden snapshot {golden_file}, save current results '
+              f'by: python bench.py parser {rows_file} update')
+        return len(results) or 1
+    return compare_with_golden(results, golden_file)
+
+
+if __name__ == '__main__':
+    import sys
+
+    modes = {
+        'batch': bench_batch,
+        'xml': bench_xml,
+        'articles': bench_articles,
+        'machine': bench_machine,
+        'replay': bench_replay,
+        'incremental': bench_incremental,
+        'parallel': bench_parallel,
+        'json': bench_json,
+        'text': bench_text,
+        'db': bench_db,
+        'parser': bench_parser,
+    }
+
+    if len(sys.argv) < 2 or sys.argv[1] not in modes:
+        print(__doc__)
+        sys.exit(1)
+
+    if sys.argv[1] == 'text' and len(sys.argv) > 2 \
+       and not sys.argv[2].isdigit():
+        texts = dump_texts(sys.argv[2])
+        print(f'Input: {sys.argv[2]}, {len(texts)} signals')
+        bench_text(texts)
+        sys.exit()
+
+    if sys.argv[1] == 'parser':
+        args = [a for a in sys.argv[2:] if a not in ('parallel', 'update')]
+        diffs = bench_parser(args[0] if args else EpiskopRows,
+                             parallel='parallel' in sys.argv,
+                             update='update' in sys.argv)
+        sys.exit(1 if diffs else 0)
+
+    times = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    xml = scaled_sample_xml(times)
+    print(f'Input: {SampleXml} x {times} = {len(xml) / 1024 / 1024:.1f} MB')
+
+    if sys.argv[1] == 'text':
+        xml = signal_texts(xml)
+    modes[sys.argv[1]](xml)
@@ -1,15 +1,24 @@
-from typing import List, Dict
+from typing import List, Dict, Iterator, Tuple
 from dataclasses import dataclass
 
+import bisect
+import itertools
 import re
-
-from chain import Chain, ChainLink, XmlSax, SaxItem  # , Printer
-from state_machine import StateMachine, State, WrongSignalException
+import struct
+import sys
+
+from chain import Chain, ChainLink, SaxItem, XmlSax, XmlExpat, XmlPart, \
+                  Collector, ParallelLink, xml_source, \
+                  print_xml_progress  # , Printer
+from state_machine import CompiledStateMachine, State, WrongSignalException, \
+                          TransitionTracer, replay
 from models import CafedraArticle, ArticleEpiskopRow, ArticleNote
-from lib.rus_eng_letters_confusion import EngInRusWordsTextPreprocessor
+from lib.rus_eng_letters_confusion import RusTextNormalizer
 
 
-@dataclass
+# Signal names are taken from code constants, so they are interned.
+# Names from other sources (files) should be interned by sys.intern.
+@dataclass(slots=True)
 class Signal:
     name: str
     data: str
@@ -24,7 +33,7 @@ class Signal:
         name, line_num, data = s.split(maxsplit=2)
         data = data if data != '##NONE##' else None
         line_num = int(line_num) if line_num != '##NONE##' else None
-        return Signal(name, data, line_num)
+        return Signal(sys.intern(name), data, line_num)
 
 
 class SignalPrinter(ChainLink):
@@ -41,9 +50,167 @@ class SignalSaver(ChainLink):
         self.f.write(s.serialize() + '\n')
         self.send(s)
 
+    def process_batch(self, items: List[Signal]):
+        self.f.writelines(s.serialize() + '\n' for s in items)
+        self.send_batch(items)
+
     def finish(self):
         self.f.close()
 
+    def close(self):
+        self.f.close()
+
+
+class SignalBinarySaver(ChainLink):
+    """
+    Saves signals to compact binary file for SignalReplay.
+
+    File format:
+    * Magic
+    * records: int32 line (-1 for None), uint16 index of name in names,
+      uint32 data length (NoData for None), utf8 data
+    * footer: utf8 json {"names": [...], "index": [[line, offset], ...],
+      "sorted": bool}, where index has offset of first record of a line
+      at least every IndexStep records, sorted is true if lines of signals
+      are nondecreasing
+    * uint64 footer offset, Magic
+    """
+    Magic = b'SIGNALS1'
+    Record = struct.Struct('<iHI')
+    Trailer = struct.Struct('<Q8s')
+    NoData = 0xFFFFFFFF
+    IndexStep = 256
+
+    def __init__(self, filename):
+        self.f = open(filename, 'wb')
+        self.f.write(self.Magic)
+        self._offset = len(self.Magic)
+        self._names = {}
+        self._index = []
+        self._last_line = None
+        self._not_indexed = self.IndexStep
+        self._sorted = True
+
+    def process(self, s: Signal):
+        self.f.write(self._pack(s))
+        self.send(s)
+
+    def process_batch(self, items: List[Signal]):
+        self.f.write(b''.join([self._pack(s) for s in items]))
+        self.send_batch(items)
+
+    def _pack(self, s: Signal) -> bytes:
+        name_id = self._names.get(s.name)
+        if name_id is None:
+            name_id = self._names[s.name] = len(self._names)
+
+        line = s.line
+        self._not_indexed += 1
+        if line is not None and line != self._last_line:
+            if self._last_line is not None and line < self._last_line:
+                self._sorted = False
+            if self._not_indexed >= self.IndexStep:
+                self._index.append((line, self._offset))
+                self._not_indexed = 0
+            self._last_line = line
+
+        if s.data is None:
+            record = self.Record.pack(-1 if line is None else line, name_id,
+                                      self.NoData)
+        else:
+            data = s.data.encode('utf8')
+            record = self.Record.pack(-1 if line is None else line, name_id,
+                                      len(data)) + data
+        self._offset += len(record)
+        return record
+
+    def finish(self):
+        import json
+        footer = json.dumps({'names': list(self._names),
+                             'index': self._index,
+                             'sorted': self._sorted}).encode('utf8')
+        self.f.write(footer)
+        self.f.write(self.Trailer.pack(self._offset, self.Magic))
+        self.f.close()
+
+    def close(self):
+        self.f.close()
+
+
+class SignalReplay(ChainLink):
+    """
+    Chain source: reads signals saved by SignalBinarySaver,
+    instead of parsing xml again.
+    process(filename) sends signals with start_line <= line <= end_line
+    (signals without line inside the range are sent too).
+    """
+    def __init__(self, start_line: int = None, end_line: int = None,
+                 batch_size: int = None):
+        self.start_line = start_line
+        self.end_line = end_line
+        self.batch_size = batch_size
+
+    def process(self, filename: str):
+        import json
+        import mmap
+
+        magic = SignalBinarySaver.Magic
+        record = SignalBinarySaver.Record
+        trailer = SignalBinarySaver.Trailer
+        with open(filename, 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            footer_offset, end_magic = trailer.unpack_from(
+                mm, len(mm) - trailer.size)
+            if mm[:len(magic)] != magic or end_magic != magic:
+                raise ValueError(f'{filename} is not signal binary file')
+            footer = json.loads(
+                mm[footer_offset:len(mm) - trailer.size].decode('utf8'))
+            names = [sys.intern(n) for n in footer['names']]
+            is_sorted = footer['sorted']
+
+            start, end = self.start_line, self.end_line
+            pos = len(magic)
+            index = footer['index']
+            if start is not None and is_sorted and index:
+                # last indexed line before start
+                i = bisect.bisect_left([line for line, _ in index], start)
+                if i > 0:
+                    pos = index[i - 1][1]
+
+            batch = []
+            unpack = record.unpack_from
+            header_size = record.size
+            no_data = SignalBinarySaver.NoData
+            while pos < footer_offset:
+                line, name_id, length = unpack(mm, pos)
+                data_end = pos + header_size
+                if length != no_data:
+                    data_end += length
+                if line == -1:
+                    line = None
+                elif end is not None and line > end:
+                    if is_sorted:
+                        break
+                    pos = data_end
+                    continue
+                elif start is not None and line < start:
+                    pos = data_end
+                    continue
+
+                data = None if length == no_data \
+                    else mm[pos + header_size:data_end].decode('utf8')
+                pos = data_end
+
+                s = Signal(names[name_id], data, line)
+                if self.batch_size:
+                    batch.append(s)
+                    if len(batch) >= self.batch_size:
+                        self.send_batch(batch)
+                        batch = []
+                else:
+                    self.send(s)
+            self.send_batch(batch)
+
 
 class SignalCounter(ChainLink):
     def __init__(self):
@@ -85,71 +252,114 @@ class CafedraSignaller(ChainLink):
                 (таких быть не должно)
 
     """
-    def __init__(self):
+    # AppliedParagraphStyle of ParagraphStyleRange -> signal type.
+    # Value may be dict: Justification of ParagraphStyleRange -> signal type,
+    # where key None is for other justifications.
+    # Other styles can be added without code changes, see
+    # parse_paragraph_styles() and data/patch/cafedra_paragraph_styles.txt
+    paragraph_styles = {
+        'ParagraphStyle/Кафедра': 'header',
+        'ParagraphStyle/Текст': 'text',
+        'ParagraphStyle/Текст1': 'text',
+        'ParagraphStyle/Таблица Заголовок': 'episkops_header',
+        'ParagraphStyle/Таблица': {'CenterAlign': 'episkops_header',
+                                   None: 'episkop'},
+        'ParagraphStyle/Таблица сжатая': {'CenterAlign': 'episkops_header',
+                                          None: 'episkop'},
+        'ParagraphStyle/Сноска с лин': 'note',
+        'ParagraphStyle/Сноска': 'note',
+        'ParagraphStyle/Footnote text': 'note',
+
+        'ParagraphStyle/КАФЕДРА ОБН.': 'header_obn',
+        'ParagraphStyle/ТЕКСТ ОБН.': 'text_obn',
+        'ParagraphStyle/ТАБЛ ОБН': 'episkop_obn',
+        'ParagraphStyle/Таблица обн сжатая': 'episkop_obn',
+        'ParagraphStyle/СНОСКА с лин. ОБН': 'note_obn',
+        'ParagraphStyle/сноска обн.': 'note_obn',
+
+        'ParagraphStyle/Normal': 'text_?',
+    }
+
+    def __init__(self, extra_styles: Dict[str, str | Dict[str, str]] = None):
+        """
+        extra_styles - paragraph styles in addition to (or instead of)
+                       CafedraSignaller.paragraph_styles
+        """
+        self.styles = dict(self.paragraph_styles)
+        if extra_styles:
+            self.styles.update(extra_styles)
+
+        # handlers of events inside tag, on which current state was set
+        self._handlers = {
+            'init': self.tag_init,
+            'ParagraphStyleRange': self.tag_ParagraphStyleRange,
+            'CharacterStyleRange': self.tag_CharacterStyleRange,
+            'Content': self.tag_Content,
+            'Properties': self.tag_Properties,
+        }
+
         self.signal_type = None
         self.cur_tag = 'init'
         self.tag_level = None
+        self._handler = self.tag_init
         self._state_stack = []
 
         self._item_text_skipped = None
+        # tag handlers send signals by it, process_batch() collects them
+        self._emit = self.send
 
     def set_state(self, signal_type, item: SaxItem):
-        old = self.signal_type, self.cur_tag, self.tag_level
-        self._state_stack.append(old)
+        self._state_stack.append((self.signal_type, self.cur_tag,
+                                  self.tag_level, self._handler))
 
-        st = (signal_type, item.name, item.level)
-        self.signal_type, self.cur_tag, self.tag_level = st
-        # print("SET", st)
+        self.signal_type = signal_type
+        self.cur_tag = item.name
+        self.tag_level = item.level
+        self._handler = self._handlers[item.name]
+        # print("SET", signal_type, item.name, item.level)
 
     def pop_state(self):
-        st = self._state_stack.pop()
-        self.signal_type, self.cur_tag, self.tag_level = st
-        # print("POP", st)
+        self.signal_type, self.cur_tag, self.tag_level, self._handler = \
+            self._state_stack.pop()
+        # print("POP", self.signal_type, self.cur_tag, self.tag_level)
 
     def process(self, item: SaxItem):
         if item.event == 'end' and item.level == self.tag_level:
             self.pop_state()
         else:
             self._item_text_skipped = True
-            getattr(self, 'tag_' + self.cur_tag)(item)
+            self._handler(item)
             if item.event == 'text' and self._item_text_skipped \
                and item.data.strip():
                 self.send(Signal("skipped", item.data, item.line))
 
+    def process_batch(self, items: List[SaxItem]):
+        # the same as process(), but signals are collected
+        # into one list for next chain link
+        out = []
+        self._emit = out.append
+        try:
+            for item in items:
+                if item.event == 'end' and item.level == self.tag_level:
+                    self.pop_state()
+                    continue
+                self._item_text_skipped = True
+                self._handler(item)
+                if item.event == 'text' and self._item_text_skipped \
+                   and item.data.strip():
+                    out.append(Signal("skipped", item.data, item.line))
+        finally:
+            self._emit = self.send
+        self.send_batch(out)
+
     def tag_init(self, item: SaxItem):
         if item.event == 'start':
             if item.name == 'ParagraphStyleRange':
-                match item.data.get('AppliedParagraphStyle'):
-                    case 'ParagraphStyle/Кафедра':
-                        self.set_state('header', item)
-                    case 'ParagraphStyle/Текст' | 'ParagraphStyle/Текст1':
-                        self.set_state('text', item)
-                    case 'ParagraphStyle/Таблица Заголовок':
-                        self.set_state('episkops_header', item)
-                    case 'ParagraphStyle/Таблица' | \
-                         'ParagraphStyle/Таблица сжатая':
-                        if item.data.get('Justification') == 'CenterAlign':
-                            self.set_state('episkops_header', item)
-                        else:
-                            self.set_state('episkop', item)
-                    case 'ParagraphStyle/Сноска с лин' | \
-                         'ParagraphStyle/Сноска' | \
-                         'ParagraphStyle/Footnote text':
-                        self.set_state('note', item)
-
-                    case 'ParagraphStyle/КАФЕДРА ОБН.':
-                        self.set_state('header_obn', item)
-                    case 'ParagraphStyle/ТЕКСТ ОБН.':
-                        self.set_state('text_obn', item)
-                    case 'ParagraphStyle/ТАБЛ ОБН' | \
-                         'ParagraphStyle/Таблица обн сжатая':
-                        self.set_state('episkop_obn', item)
-                    case 'ParagraphStyle/СНОСКА с лин. ОБН' | \
-                         'ParagraphStyle/сноска обн.':
-                        self.set_state('note_obn', item)
-
-                    case 'ParagraphStyle/Normal':
-                        self.set_state('text_?', item)
+                st = self.styles.get(item.data.get('AppliedParagraphStyle'))
+                if isinstance(st, dict):
+                    st = st.get(item.data.get('Justification'), st.get(None))
+                if st:
+                    self.set_state(st, item)
             elif item.name == 'Properties':
                 self.set_state('props', item)
 
@@ -171,36 +381,72 @@ class CafedraSignaller(ChainLink):
             if item.name == 'Content':
                 self.set_state(self.signal_type, item)
             elif item.name == 'Br':
-                self.send(Signal('br', None, item.line))
+                self._emit(Signal('br', None, item.line))
             elif item.name == 'Properties':
                 self.set_state('props', item)
 
     def tag_Content(self, item: SaxItem):
         if item.event == 'text':
             self._item_text_skipped = False
-            self.send(Signal(self.signal_type, item.data, item.line))
+            self._emit(Signal(self.signal_type, item.data, item.line))
 
     def tag_Properties(self, item: SaxItem):
         if item.event == 'text':
             self._item_text_skipped = False
-            self.send(Signal(self.signal_type, item.data, item.line))
+            self._emit(Signal(self.signal_type, item.data, item.line))
 
     def finish(self):
         pass
 
 
+def parse_paragraph_styles(text: str) -> Dict[str, str | Dict[str, str]]:
+    """
+    Parses paragraph styles for CafedraSignaller(extra_styles=...).
+    Line format: signal_type justification paragraph_style
+    where justification is * for any justification. Example:
+    episkop         *            ParagraphStyle/Таблица новая
+    episkops_header CenterAlign  ParagraphStyle/Таблица новая
+    """
+    res = {}
+    for line in text.split('\n'):
+        l = line.strip()  # noqa: E741
+        if not l or l.startswith('#'):
+            continue
+
+        signal_type, justification, style = l.split(maxsplit=2)
+        if justification == '*':
+            justification = None
+        st = res.setdefault(style, {})
+        st[justification] = signal_type
+
+    # single signal type for any justification is stored as str
+    for style, st in res.items():
+        if list(st) == [None]:
+            res[style] = st[None]
+    return res
+
+
 class SkippedTextCatcher(ChainLink):
     def __init__(self, fail_on_skipped=True):
         self.fail_on_skipped = fail_on_skipped
 
     def process(self, s: Signal):
         if s.name == 'skipped':
-            if self.fail_on_skipped:
-                raise ValueError('Skipped text detected: ' + str(s))
-            else:
-                print('!!!! SKIPPED', s)
+            self._skipped(s)
         self.send(s)
 
+    def process_batch(self, items: List[Signal]):
+        for s in items:
+            if s.name == 'skipped':
+                self._skipped(s)
+        self.send_batch(items)
+
+    def _skipped(self, s: Signal):
+        if self.fail_on_skipped:
+            raise ValueError('Skipped text detected: ' + str(s))
+        else:
+            print('!!!! SKIPPED', s)
+
 
 def replace_u2028(s):
     """
@@ -220,28 +466,38 @@ def replace_u2028(s):
 
 
 class TextCleaner(ChainLink):
+    """
+    Replaces \\u2028 and latin letters in cyrillic words,
+    see RusTextNormalizer.
+    Former replace_u2028() + EngInRusWordsTextPreprocessor().process()
+    """
     def __init__(self):
-        self.fixer = EngInRusWordsTextPreprocessor().process
+        # TODO Сейчас заменяются английские буквы только внутри
+        # кириллических слов.
+        # Если сделать replace_single=True, то будут заменяться на
+        # русские и одиночные английские буквы.
+        # Это ломает английские источники, римские X и проч,
+        # но в некоторых случаях это надо сделать - встречается
+        # предлог 'с' и инициалы, записанные английскими буквами.
+        # Когда-нибудь надо запустить с True, сравнить articles.json
+        # и при помощи signal patch вручную поправить нужные места.
+        self.normalizer = RusTextNormalizer(replace_single=False)
+        self.normalize = self.normalizer.normalize
 
     def process(self, sig: Signal):
-        if sig.data:
-            if '\u2028' in sig.data:
-                # print("!!!!!", sig)
-                sig.data = replace_u2028(sig.data)
-
-            # TODO Сейчас заменяются английские буквы только внутри
-            # кириллических слов.
-            # Если сделать replace_single=True, то будут заменяться на
-            # русские и одиночные английские буквы.
-            # Это ломает английские источники, римские X и проч,
-            # но в некоторых случаях это надо сделать - встречается
-            # предлог 'с' и инициалы, записанные английскими буквами.
-            # Когда-нибудь надо запустить с True, сравнить articles.json
-            # и при помощи signal patch вручную поправить нужные места.
-            sig.data = self.fixer(sig.data, replace_single=False)
-
+        self.clean(sig)
         self.send(sig)
 
+    def process_batch(self, items: List[Signal]):
+        texts = self.normalizer.normalize_batch([s.data for s in items])
+        for sig, text in zip(items, texts):
+            sig.data = text
+        self.send_batch(items)
+
+    def clean(self, sig: Signal):
+        if sig.data:
+            sig.data = self.normalize(sig.data)
+
 
 class SignalTool(ChainLink):
     def __init__(self, cur_name, prev_name=None, prev_prev_name=None):
@@ -285,29 +541,54 @@ class SignalPatcher(ChainLink):
     def process(self, s: Signal):
         patch = self.patches.get(s.line)
         if patch:
-            expected_data, new_signal_name = patch
-            if new_signal_name == 'SKIP!':
-                return
-            elif new_signal_name == 'EDIT!':
-                expected_data, new_signal_data = expected_data.split('===>')
-
-            if not (s.data == expected_data
-               or s.data.strip().startswith(expected_data.strip())):
-                raise Exception("Signal and patch different: expected "
-                                f"'{expected_data}' for signal {s}")
-
-            if new_signal_name == 'BR!':
-                # add BR before signal
-                self.send(Signal('br', None, s.line))
-            elif new_signal_name == 'EDIT!':
-                s.data = new_signal_data
+            for x in self._apply(patch, s, []):
+                self.send(x)
+        else:
+            self.send(s)
+
+    def process_batch(self, items: List[Signal]):
+        if not self.patches:
+            return self.send_batch(items)
+
+        out = []
+        get_patch = self.patches.get
+        for s in items:
+            patch = get_patch(s.line)
+            if patch:
+                self._apply(patch, s, out)
             else:
-                s.name = new_signal_name
+                out.append(s)
+        self.send_batch(out)
 
-        self.send(s)
+    def _apply(self, patch: tuple, s: Signal, out: List[Signal]):
+        """
+        applies patch to signal s and appends resulting signals to out
+        """
+        expected_data, new_signal_name = patch
+        if new_signal_name == 'SKIP!':
+            return out
+        elif new_signal_name == 'EDIT!':
+            expected_data, new_signal_data = expected_data.split('===>')
+
+        if not (s.data == expected_data
+           or s.data.strip().startswith(expected_data.strip())):
+            raise Exception("Signal and patch different: expected "
+                            f"'{expected_data}' for signal {s}")
+
+        if new_signal_name == 'BR!':
+            # add BR before signal
+            out.append(Signal('br', None, s.line))
+        elif new_signal_name == 'EDIT!':
+            s.data = new_signal_data
+        else:
+            s.name = new_signal_name
+
+        out.append(s)
+        return out
 
 
 cafedra_signals_patch = open('data/patch/cafedra_signal_patch.txt', encoding='utf8').read()
+cafedra_paragraph_styles = open('data/patch/cafedra_paragraph_styles.txt', encoding='utf8').read()
 
 
 def parse_text_patch(text_patch):
@@ -325,6 +606,25 @@ def parse_text_patch(text_patch):
     return res
 
 
+def cafedra_signal_chain(
+        source: ChainLink, patches: Dict[int, tuple] = None,
+        extra_styles: Dict[str, str | Dict[str, str]] = None,
+        savers: List[ChainLink] = ()) -> Chain:
+    """
+    Chain of book signals for CafedraArticleBuilder: xml source ->
+    CafedraSignaller -> savers of raw signals -> SkippedTextCatcher ->
+    TextCleaner -> SignalPatcher(patches).
+    SignalReplay source sends saved raw signals: no CafedraSignaller.
+    """
+    chain = Chain(source)
+    if not isinstance(source, SignalReplay):
+        chain.add(CafedraSignaller(extra_styles))
+    for saver in savers:
+        chain.add(saver)
+    return chain.add(SkippedTextCatcher()).add(TextCleaner()) \
+        .add(SignalPatcher(patches or {}))
+
+
 class CafedraArticleBuilder(ChainLink):
     # При составлении правил надо иметь ввиду, что пока мы находимся в рамках
     # одного состояния сигналы складируются в self.state_data с целью сбора
@@ -388,12 +688,24 @@ class CafedraArticleBuilder(ChainLink):
         'ЯРОСЛАВСКАЯ, григ.'
     ]
 
-    def __init__(self):
-        self.machine = StateMachine(self.states, 'expect_header', self)
+    TraceFile = 'data/state_machine_trace.jsonl'
+
+    def __init__(self, trace_size: int = None, trace_file: str = TraceFile):
+        """
+        trace_size - keep this number of last state machine transitions
+                     and save them to trace_file on error (see replay_trace)
+        """
+        self.machine = CompiledStateMachine(self.states, 'expect_header', self)
+        if trace_size:
+            self.machine.set_tracer(TransitionTracer(
+                trace_size, trace_file,
+                serialize_data=lambda s: [s.name, s.data, s.line]))
         self.state_data = []
 
         self.caf = None
         self._cur_note_number = None
+        # articles built by current process_batch()
+        self._batch = None
 
     def add_state_data(self, data):
         self.state_data.append(data)
@@ -414,7 +726,11 @@ class CafedraArticleBuilder(ChainLink):
             if self.caf.is_link:
                 sig_name += '_link'
             assert self._cur_note_number is None
-            self.send(Signal(sig_name, self.caf, self.caf.start_line))
+            s = Signal(sig_name, self.caf, self.caf.start_line)
+            if self._batch is not None:
+                self._batch.append(s)
+            else:
+                self.send(s)
 
         self.caf = CafedraArticle()
 
@@ -430,6 +746,16 @@ class CafedraArticleBuilder(ChainLink):
             # except Exception as ex:     - this makes system exceptions unreadable  # noqa: E501
             #    raise Exception(f"{s.line}: {ex}")
 
+    def process_batch(self, items: List[Signal]):
+        # articles are rare, they are sent as one batch
+        out = self._batch = []
+        try:
+            for s in items:
+                self.process(s)
+        finally:
+            self._batch = None
+        self.send_batch(out)
+
     def on_enter_state(self, sig: str, signal: Signal, machine):
         self.clear_state_data()
         if sig != 'br':
@@ -496,6 +822,16 @@ class CafedraArticleBuilder(ChainLink):
     def on_note_obn_exit(self, sig: str, signal: Signal, machine):
         self._build_note()
 
+    def reset(self):
+        """
+        prepares builder for signals of other part of book,
+        which starts from header
+        """
+        self.machine.set_state('expect_header', run_callbacks=False)
+        self.clear_state_data()
+        self.caf = None
+        self._cur_note_number = None
+
     def finish(self):
         if self.machine.state.name not in ('note', 'note_obn'):
             raise Exception(f'Wrong finish state of state machine: '
@@ -505,6 +841,28 @@ class CafedraArticleBuilder(ChainLink):
         self.machine.set_state('expect_header', run_callbacks=True)
         self.send_cafedra_and_create_new()
 
+    @staticmethod
+    def replay_trace(trace_file: str = TraceFile):
+        """
+        Re-runs signals, saved by tracer, from start of first article
+        in trace. Built articles are printed.
+        Returns transitions with different state after replay.
+        """
+        builder = CafedraArticleBuilder()
+        builder.set_next(SignalPrinter())
+        transitions = TransitionTracer.load(trace_file)
+        # trace may start in the middle of book: first header comes
+        # from end of previous article (e.g. 'note' state), but builder
+        # starts article as at book start
+        diff = replay(transitions, builder.machine,
+                      load_data=lambda v: Signal(*v),
+                      start_signals=['header', 'header_obn'],
+                      send=lambda sig, s: builder.process(s),
+                      start_state='expect_header')
+        for t in diff:
+            print('Different state after replay:', t)
+        return diff
+
     @property
     def header(self):
         return self.caf.header
@@ -591,83 +949,674 @@ def join_signals_html(signals: List[Signal], strip=True):
 
 
 class CafedraArticlesToJsonFile(ChainLink):
-    def __init__(self, path):
+    def __init__(self, path, jsonl: bool = None):
+        """
+        jsonl - write JSON Lines: one compact article per line
+                instead of pretty printed json array
+                (None - if path ends with .jsonl)
+        """
         self.path = path
+        self.jsonl = path.endswith('.jsonl') if jsonl is None else jsonl
         self.out = open(path, 'w', encoding='utf8')
-        self.out.write('[\n')
+        if not self.jsonl:
+            self.out.write('[\n')
         self._first = True
 
-    def process(self, s: Signal):
+    @staticmethod
+    def to_json(caf: CafedraArticle) -> str:
+        import json
+        return json.dumps(caf.to_dict(), ensure_ascii=False, indent=4)
+
+    @staticmethod
+    def to_json_line(caf: CafedraArticle) -> str:
         import json
+        return json.dumps(caf.to_dict(), ensure_ascii=False)
+
+    def process(self, s: Signal):
         if not isinstance(s.data, CafedraArticle):
             raise ValueError('Expected Signal with CafedraArticle object '
                              'in data field')
 
-        json_data = json.dumps(s.data.to_dict(), ensure_ascii=False, indent=4)
-        if not self._first:
-            self.out.write(',\n')
+        if self.jsonl:
+            json_data = self.to_json_line(s.data)
+            self.out.write(json_data + '\n')
         else:
-            self._first = False
-        self.out.write(json_data)
+            json_data = self.to_json(s.data)
+            if not self._first:
+                self.out.write(',\n')
+            else:
+                self._first = False
+            self.out.write(json_data)
 
         self.send(Signal(s.name, f'{s.data.header} | {len(json_data)/1024: .1f} kb', s.line))  # noqa: E501
 
     def finish(self):
-        self.out.write('\n]\n')
+        if not self.jsonl:
+            self.out.write('\n]\n')
         size = self.out.tell() + 1
         self.out.close()
         self.send(Signal('json_file', self.path, None))
         self.send(Signal('json_file_size', size, None))
 
+    def close(self):
+        self.out.close()
+
 
 class CafedraArticlesFromJson(ChainLink):
+    """
+    Reads articles from json file, written by CafedraArticlesToJsonFile:
+    json array or JSON Lines. Articles are read and sent one by one,
+    so whole file isn't loaded in memory.
+    """
+    def __init__(self, batch_size: int = None):
+        """
+        batch_size - send articles to next link by lists of this size
+                     (None - send every article separately)
+        """
+        self.batch_size = batch_size
+
     @staticmethod
     def load_parsed_book(json_file: str) -> List[CafedraArticle]:
+        return list(CafedraArticlesFromJson.iter_parsed_book(json_file))
+
+    @staticmethod
+    def iter_parsed_book(json_file: str, chunk_size: int = 2**16) \
+            -> Iterator[CafedraArticle]:
+        """
+        yields articles of json array or JSON Lines file
+        """
+        with open(json_file, encoding='utf8') as f:
+            buf = f.read(chunk_size)
+            if buf.lstrip().startswith('['):
+                items = CafedraArticlesFromJson._iter_json_array(
+                    f, buf, chunk_size)
+            else:
+                items = CafedraArticlesFromJson._iter_json_lines(f, buf)
+            for d in items:
+                yield CafedraArticle.from_dict(d)
+
+    @staticmethod
+    def _iter_json_lines(f, buf: str) -> Iterator[dict]:
         import json
-        db = json.load(open(json_file))
-        assert isinstance(db, list)
+        # not splitlines(): it splits by \\u2028 in text too
+        head = (buf + f.readline()).split('\n')
+        for line in itertools.chain(head, f):
+            if line.strip():
+                yield json.loads(line)
 
-        for i in range(len(db)):
-            db[i] = CafedraArticle.from_dict(db[i])
+    @staticmethod
+    def _iter_json_array(f, buf: str, chunk_size: int) -> Iterator[dict]:
+        """
+        parses items of json array one by one, reading file by chunks
+        """
+        import json
+        decoder = json.JSONDecoder()
+        pos = buf.index('[') + 1
+        while True:
+            # skip separators
+            while True:
+                while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                    pos += 1
+                if pos < len(buf):
+                    break
+                buf, pos = f.read(chunk_size), 0
+                if not buf:
+                    raise ValueError(f'{f.name}: unexpected end of json')
+
+            if buf[pos] == ']':
+                return
 
-        return db
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                # item isn't read completely
+                more = f.read(max(chunk_size, len(buf) - pos))
+                if not more:
+                    raise
+                buf, pos = buf[pos:] + more, 0
+                continue
+
+            if not isinstance(item, dict):
+                raise ValueError(f'{f.name}: expected json object, '
+                                 f'got {item!r}')
+            yield item
+            pos = end
 
     def process(self, json_filename):
-        signals = self.load_parsed_book(json_filename)
+        articles = self.iter_parsed_book(json_filename)
 
-        for s in signals:
+        if self.batch_size:
+            while True:
+                batch = list(itertools.islice(articles, self.batch_size))
+                if not batch:
+                    return
+                self.send_batch(batch)
+
+        for s in articles:
             s: CafedraArticle
             self.send(s)
 
 
-if __name__ == '__main__':
-    import sys
-    chain = Chain(XmlSax()) \
-        .add(CafedraSignaller()) \
-        .add(SignalSaver('data/cafedra_signals.txt')) \
-        .add(SkippedTextCatcher()).add(TextCleaner()) \
-        .add(SignalPatcher(parse_text_patch(cafedra_signals_patch)))
-    if 'articles' in sys.argv:
-        chain.add(CafedraArticleBuilder())\
-             .add(CafedraArticlesToJsonFile('data/cafedra_articles.json'))
-    elif 'tool' in sys.argv:
-        chain.add(SignalTool('header', 'br', 'header'))
+@dataclass
+class CafedraSpan:
+    """
+    Part of book xml from one cafedra header paragraph to the next one,
+    see CafedraXmlSplitter
+    """
+    part: XmlPart
+    # header paragraphs of next span (they end last article of span),
+    # None for last span
+    next_part: XmlPart = None
+    # number of span in book
+    index: int = 0
 
-    if not ('no' in sys.argv and 'print' in sys.argv and
-       sys.argv.index('print') - sys.argv.index('no') == 1):
-        chain.add(SignalPrinter())
+    @property
+    def text(self) -> str:
+        p = self.part
+        return p.xml[p.start:p.end] if p.end is not None else p.xml[p.start:]
 
-    if 'count' in sys.argv:
-        chain.add(SignalCounter())
+
+class CafedraXmlSplitter(ChainLink):
+    """
+    Splits book xml to independent CafedraSpans at cafedra header
+    paragraphs (styles of 'header' and 'header_obn' signals).
+    Several header paragraphs in a row are one span.
+    All headers must be at the same level of xml elements and there must
+    be no paragraphs after end of their parent element.
+    Spans are cut by paragraph styles, signal patches are applied by
+    CafedraSpanArticleBuilder.
+    Signals and articles of every span can be built separately by
+    CafedraSpanArticleBuilder.
+
+    process(xml_filename) sends CafedraSpans.
+    """
+    def __init__(self, extra_styles: Dict[str, str | Dict[str, str]] = None,
+                 copy_text: bool = False):
+        """
+        copy_text - XmlPart of span has only text of span instead of full
+                    xml text (for sending spans to other processes)
+        """
+        self.styles = CafedraSignaller(extra_styles).styles
+        self.copy_text = copy_text
+
+    def process(self, xml_filename: str):
+        with open(xml_filename, encoding='utf8') as f:
+            xml = f.read()
+        for span in self.split(xml):
+            self.send(span)
+
+    def header_styles(self) -> Dict[str, str]:
+        """
+        paragraph style -> header signal type
+        """
+        res = {}
+        for style, st in self.styles.items():
+            if isinstance(st, dict):
+                if any(x in ('header', 'header_obn') for x in st.values()):
+                    raise ValueError(f'Splitting of xml does not support '
+                                     f'header style by justification: '
+                                     f'{style}')
+            elif st in ('header', 'header_obn'):
+                res[style] = st
+        return res
+
+    def split(self, xml: str) -> List[CafedraSpan]:
+        from xml.sax.saxutils import quoteattr
+
+        by_attr = {quoteattr(style): sig
+                   for style, sig in self.header_styles().items()}
+        header_re = re.compile(
+            r'<ParagraphStyleRange\s[^>]*?AppliedParagraphStyle=(%s)'
+            % '|'.join(re.escape(a) for a in by_attr))
+
+        # [start of first header paragraph, start of last one]
+        groups = []
+        for m in header_re.finditer(xml):
+            # header of several paragraphs is one span
+            if groups and xml.count('<ParagraphStyleRange',
+                                    groups[-1][1], m.start()) == 1:
+                groups[-1][1] = m.start()
+                continue
+            groups.append([m.start(), m.start()])
+
+        if not groups:
+            return []
+        if '<ParagraphStyleRange' in xml[:groups[0][0]]:
+            raise ValueError('Splitting of xml: paragraphs before '
+                             'first cafedra header')
+
+        # span before header at other level would not be sequence
+        # of whole elements
+        levels, tail_line = self._levels_at(
+            xml, [start for start, _ in groups])
+        if len(set(levels)) > 1:
+            raise ValueError('Splitting of xml: cafedra headers at '
+                             'different levels of xml elements')
+        if tail_line is not None:
+            raise ValueError(f'Splitting of xml: paragraph at line '
+                             f'{tail_line} after end of parent element '
+                             f'of cafedra headers')
+        level = levels[0]
+
+        def make_part(start, end, line):
+            if self.copy_text:
+                text = xml[start:end] if end is not None else xml[start:]
+                return XmlPart(text, 0, len(text) if end is not None
+                               else None, level, line, offset=start)
+            return XmlPart(xml, start, end, level, line)
+
+        line = xml.count('\n', 0, groups[0][0]) + 1
+        spans = []
+        next_part = None
+        for i, (start, _) in enumerate(groups):
+            if i + 1 < len(groups):
+                end, last_header = groups[i + 1]
+                # headers end at next paragraph (or at end of parent)
+                headers_end = xml.find('<ParagraphStyleRange',
+                                       last_header + 1)
+                next_line = line + xml.count('\n', start, end)
+                next_part = make_part(end, None if headers_end < 0
+                                      else headers_end, next_line)
+            else:
+                # end of parent element of headers
+                end, next_part = None, None
+
+            spans.append(CafedraSpan(make_part(start, end, line),
+                                     next_part, i))
+            if end is not None:
+                line = next_line
+        return spans
+
+    @staticmethod
+    def _levels_at(xml: str, positions: List[int]) \
+            -> Tuple[List[int], int | None]:
+        """
+        levels of elements starting at sorted positions and line of
+        first paragraph after end of parent element of last position
+        (None if there is no such paragraph), xml is parsed once
+        """
+        from xml.parsers import expat
+
+        level = 0
+        parent_level = None  # known after last position
+        parent_closed = False
+        tail_line = None
+
+        def start_element(name, attrs):
+            nonlocal level, tail_line
+            if parent_closed and tail_line is None \
+                    and name in ('ParagraphStyleRange', 'Properties'):
+                tail_line = parser.CurrentLineNumber
+            level += 1
+
+        def end_element(name):
+            nonlocal level, parent_closed
+            level -= 1
+            if level == parent_level:
+                parent_closed = True
+
+        parser = expat.ParserCreate()
+        parser.StartElementHandler = start_element
+        parser.EndElementHandler = end_element
+        levels = []
+        prev = 0
+        for pos in positions:
+            # xml before start tag has only whole tags
+            parser.Parse(xml[prev:pos], False)
+            levels.append(level)
+            prev = pos
+        parent_level = levels[-1] - 1
+        parser.Parse(xml[prev:], True)
+        return levels, tail_line
+
+
+class _SpanSignalGate(ChainLink):
+    """
+    Passes to CafedraSpanArticleBuilder only signals of span after
+    signal patches: skips signals before first header (they belong
+    to previous span, e.g. if patch deleted header of first paragraph)
+    and stops after first header of next span.
+    """
+    Headers = ('header', 'header_obn')
+
+    def start(self, skip_lead: bool):
+        self.skip_lead = skip_lead
+        self.in_next_span = False
+        self.done = False
+
+    def process(self, s: Signal):
+        self.process_batch([s])
+
+    def process_batch(self, items: List[Signal]):
+        if self.done:
+            return
+        begin, end = 0, len(items)
+        for i, s in enumerate(items):
+            if s.name in self.Headers:
+                if self.in_next_span:
+                    end = i + 1
+                    self.done = True
+                    break
+                self.skip_lead = False
+            elif self.skip_lead:
+                begin = i + 1
+        self.send_batch(items[begin:end])
+
+
+class CafedraSpanArticleBuilder(ChainLink):
+    """
+    Signals and builds articles of CafedraSpans, sends article signals
+    as CafedraArticleBuilder does. Articles are the same as
+    in sequential processing of whole xml: span is cut by patched signals,
+    from its first header signal to first header signal of header
+    paragraphs of next span (ValueError if patches leave no header
+    in them). Used in ParallelLink to build book by several processes.
+    """
+    def __init__(self, patches: Dict[int, tuple] = None,
+                 extra_styles: Dict[str, str | Dict[str, str]] = None):
+        self.builder = CafedraArticleBuilder()
+        self._articles = Collector()
+        self._gate = _SpanSignalGate()
+        self.chain = cafedra_signal_chain(XmlExpat(batch_size=1000), patches,
+                                          extra_styles) \
+            .add(self._gate) \
+            .add(self.builder) \
+            .add(self._articles)
+
+    def process(self, span: CafedraSpan):
+        for s in self.build(span):
+            self.send(s)
+
+    def build(self, span: CafedraSpan) -> List[Signal]:
+        self.builder.reset()
+        self._articles.items = []
+        gate = self._gate
+        gate.start(skip_lead=span.index > 0)
+        # not Chain.process(): it finishes links
+        self.chain.links[0].process(span.part)
+        if gate.skip_lead:
+            raise ValueError(f'Splitting of xml: signal patches leave no '
+                             f'cafedra header in span at line '
+                             f'{span.part.line}')
+        if span.next_part:
+            # articles are sent by builder on header of next span
+            gate.in_next_span = True
+            self.chain.links[0].process(span.next_part)
+            if not gate.done:
+                raise ValueError(f'Splitting of xml: signal patches leave '
+                                 f'no cafedra header in paragraphs at line '
+                                 f'{span.next_part.line}')
+        else:
+            self.builder.finish()
+        return self._articles.items
+
+
+class CafedraArticlesIncrementalBuild:
+    """
+    Incremental build of articles json file: xml is split to spans
+    from one cafedra header paragraph to the next one, and only spans
+    changed since previous build are signalled and built again.
+    Articles of other spans are taken from previous json file.
+
+    Manifest file keeps fingerprints of spans (text, start line, header
+    paragraphs of next span, signal patches of lines of both) and places of
+    span articles in json file. If code of parser, paragraph styles
+    or json file itself are changed, all spans are built again.
+
+    Result is identical to full build by CafedraArticlesToJsonFile
+    (XmlPart is parsed with the same blocks as full xml).
+    Signal dumps are not saved.
+    """
+    Sources = ['book_parser.py', 'chain.py', 'state_machine.py', 'models.py',
+               'lib/rus_eng_letters_confusion.py']
+
+    def __init__(self, json_path: str, manifest_path: str = None,
+                 patches: Dict[int, tuple] = None,
+                 extra_styles: Dict[str, str | Dict[str, str]] = None):
+        self.json_path = json_path
+        self.manifest_path = manifest_path or json_path + '.manifest'
+        self.patches = patches or {}
+        self.splitter = CafedraXmlSplitter(extra_styles)
+        self.span_builder = CafedraSpanArticleBuilder(self.patches,
+                                                      extra_styles)
+        self.rebuilt = 0
+        self.total = 0
+
+    def version(self) -> str:
+        """
+        fingerprint of parser code and configuration
+        """
+        import hashlib
+        import os
+
+        h = hashlib.blake2b(digest_size=16)
+        base = os.path.dirname(os.path.abspath(__file__))
+        for name in self.Sources:
+            with open(os.path.join(base, name), 'rb') as f:
+                h.update(f.read())
+        h.update(repr(sorted(self.splitter.styles.items(),
+                             key=lambda x: x[0])).encode('utf8'))
+        return h.hexdigest()
+
+    def span_key(self, span: CafedraSpan) -> str:
+        import hashlib
+
+        text = span.text
+        # header paragraphs of next span end last article of span,
+        # so their text and patches are part of the key too
+        next_text = '' if not span.next_part else \
+            span.next_part.xml[span.next_part.start:span.next_part.end]
+        line = span.part.line
+        last_line = line + text.count('\n') + next_text.count('\n')
+        patches = sorted((k, v) for k, v in self.patches.items()
+                         if k is not None and line <= k <= last_line)
+
+        h = hashlib.blake2b(digest_size=16)
+        h.update(text.encode('utf8'))
+        h.update(next_text.encode('utf8'))
+        h.update(repr((line, patches)).encode('utf8'))
+        return h.hexdigest()
+
+    def load_previous(self, version: str) -> Dict[str, str]:
+        """
+        span key -> json text of span articles from previous build
+        """
+        import hashlib
+        import json
+        import os
+
+        if not (os.path.exists(self.manifest_path)
+                and os.path.exists(self.json_path)):
+            return {}
+        with open(self.manifest_path, encoding='utf8') as f:
+            manifest = json.load(f)
+        with open(self.json_path, encoding='utf8') as f:
+            old_json = f.read()
+        json_hash = hashlib.blake2b(old_json.encode('utf8'),
+                                    digest_size=16).hexdigest()
+        if manifest['version'] != version \
+                or manifest['json_hash'] != json_hash:
+            return {}
+
+        return {key: old_json[offset:offset + length]
+                for key, offset, length in manifest['spans']}
+
+    def build(self, xml_filename: str):
+        import hashlib
+        import json
+
+        with open(xml_filename, encoding='utf8') as f:
+            xml = f.read()
+
+        version = self.version()
+        previous = self.load_previous(version)
+        spans = self.splitter.split(xml)
+
+        out = ['[\n']
+        offset = len(out[0])
+        manifest_spans = []
+        self.rebuilt = 0
+        self.total = len(spans)
+        for span in spans:
+            key = self.span_key(span)
+            text = previous.get(key)
+            if text is None:
+                text = ',\n'.join(CafedraArticlesToJsonFile.to_json(s.data)
+                                   for s in self.span_builder.build(span))
+                self.rebuilt += 1
+
+            if text:
+                if len(out) > 1:
+                    out.append(',\n')
+                    offset += 2
+                out.append(text)
+            manifest_spans.append((key, offset, len(text)))
+            offset += len(text)
+        out.append('\n]\n')
+        json_text = ''.join(out)
+
+        with open(self.json_path, 'w', encoding='utf8') as f:
+            f.write(json_text)
+        with open(self.manifest_path, 'w', encoding='utf8') as f:
+            json.dump({
+                'version': version,
+                'json_hash': hashlib.blake2b(json_text.encode('utf8'),
+                                             digest_size=16).hexdigest(),
+                'spans': manifest_spans,
+            }, f)
+
+
+if __name__ == '__main__':
+    """
+    All requested outputs are built in one pass of xml:
+    * articles - save articles to data/cafedra_articles.json
+      (jsonl - to data/cafedra_articles.jsonl, one article per line)
+    * tool - find signals sequences by SignalTool
+    * count - count signals
+    * print - print signals (default if no articles and tool)
+    * no print - don't print anything (signals, articles, tool results)
+    * trace - save last state machine transitions of CafedraArticleBuilder
+              on error to data/state_machine_trace.jsonl
+    * replay - only re-run articles builder from saved trace
+    * signals - read signals from data/cafedra_signals.bin instead of xml,
+                lines=<start>:<end> - only signals of given xml lines
+    * incremental - build data/cafedra_articles.json again only for
+                    cafedras, changed in xml since previous incremental
+                    build (see CafedraArticlesIncrementalBuild)
+    * parallel - only build articles (json, jsonl, print of articles)
+                 by several processes: xml is split at cafedra headers
+                 (see CafedraXmlSplitter), signal options (tool, count,
+                 trace, signals, sax, progress) are not supported
+    Signals are always saved to data/cafedra_signals.txt
+    and data/cafedra_signals.bin (if xml is parsed by one process)
+    """
+    if 'replay' in sys.argv:
+        try:
+            CafedraArticleBuilder.replay_trace()
+        except ValueError as ex:
+            print(ex)
+        sys.exit(0)
 
     filename = 'data/sample_cafedry.xml'
     if len(sys.argv) > 1 and sys.argv[1].endswith('.xml'):
         filename = sys.argv[1]
 
-    with open(filename, encoding='utf8') as f:
+    no_print = 'no' in sys.argv and 'print' in sys.argv and \
+        sys.argv.index('print') - sys.argv.index('no') == 1
+    json_file = 'data/cafedra_articles.jsonl' if 'jsonl' in sys.argv \
+        else 'data/cafedra_articles.json'
+
+    if 'parallel' in sys.argv:
+        import functools
+        unsupported = [a for a in sys.argv
+                       if a in ('tool', 'count', 'trace', 'signals', 'sax',
+                                'progress', 'incremental')
+                       or a.startswith('lines=')]
+        if unsupported:
+            print('Not supported in parallel mode:', ' '.join(unsupported))
+            sys.exit(1)
+        styles = parse_paragraph_styles(cafedra_paragraph_styles)
+        chain = Chain(CafedraXmlSplitter(styles, copy_text=True)) \
+            .add(ParallelLink(functools.partial(
+                CafedraSpanArticleBuilder,
+                parse_text_patch(cafedra_signals_patch), styles), chunk=20)) \
+            .add(CafedraArticlesToJsonFile(json_file))
+        if not no_print:
+            chain.add(SignalPrinter())
+        try:
+            chain.process(filename)
+        except ValueError as ex:
+            print(ex)
+        sys.exit(0)
+
+    if 'incremental' in sys.argv:
+        inc = CafedraArticlesIncrementalBuild(
+            'data/cafedra_articles.json',
+            patches=parse_text_patch(cafedra_signals_patch),
+            extra_styles=parse_paragraph_styles(cafedra_paragraph_styles))
         try:
-            chain.process(f)
+            inc.build(filename)
+            print(f'Rebuilt {inc.rebuilt} of {inc.total} spans')
         except ValueError as ex:
             print(ex)
+        sys.exit(0)
+
+    # 'sax' in args - use old xml.sax based XmlSax instead of XmlExpat
+    # 'progress' in args - XmlSax with progress reporting
+    engine = 'sax' if 'sax' in sys.argv else 'expat'
+    from_signals = 'signals' in sys.argv
+    if from_signals:
+        lines = [a[len('lines='):] for a in sys.argv
+                 if a.startswith('lines=')]
+        m = re.fullmatch(r'(\d*):(\d*)', lines[0]) if lines else None
+        if lines and not m:
+            print(f'Wrong lines={lines[0]}, expected lines=<start>:<end>'
+                  ' with optional numbers, e.g. lines=100:200 or lines=100:')
+            sys.exit(1)
+        start_line, end_line = m.groups() if m else (None, None)
+        source = SignalReplay(int(start_line) if start_line else None,
+                              int(end_line) if end_line else None,
+                              batch_size=1000)
+    elif 'progress' in sys.argv:
+        source = XmlSax(batch_size=1000, progress=print_xml_progress)
+    else:
+        source = xml_source(engine, batch_size=1000)
+    savers = [] if from_signals else [
+        SignalSaver('data/cafedra_signals.txt'),
+        SignalBinarySaver('data/cafedra_signals.bin')]
+    chain = cafedra_signal_chain(
+        source, parse_text_patch(cafedra_signals_patch),
+        parse_paragraph_styles(cafedra_paragraph_styles), savers)
+
+    print_signals = not no_print and (
+        'print' in sys.argv
+        or not ('articles' in sys.argv or 'tool' in sys.argv))
+
+    branches = []
+    if 'articles' in sys.argv:
+        branches.append(
+            Chain(CafedraArticleBuilder(
+                      trace_size=10000 if 'trace' in sys.argv else None))
+            .add(CafedraArticlesToJsonFile(json_file)))
+    if 'tool' in sys.argv:
+        branches.append(Chain(SignalTool('header', 'br', 'header')))
+    if not no_print:
+        for b in branches:
+            b.add(SignalPrinter())
+    if print_signals:
+        branches.append(Chain(SignalPrinter()))
+    if 'count' in sys.argv:
+        branches.append(Chain(SignalCounter()))
+
+    chain.tee(*branches)
+
+    try:
+        if from_signals:
+            chain.process('data/cafedra_signals.bin')
+        else:
+            with open(filename, encoding='utf8') as f:
+                chain.process(f)
+    except ValueError as ex:
+        print(ex)
 
     # print(texter.get_text())
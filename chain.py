@@ -1,16 +1,42 @@
 from xml import sax
-from typing import Union, List, Dict
-from dataclasses import dataclass
+from xml.parsers import expat
+from typing import Union, List, Callable
+from dataclasses import dataclass, asdict
+from collections import deque
 import inspect
+import io
+import itertools
+import json
+import os
+import sys
+import time
+import threading
+import queue
 
 
 """
 Chain of data processing steps
+
+profile - collect per link statistics (items in/out, time) and print
+          them on finish. By default enabled by env var CHAIN_PROFILE=1
+profile_json - also save statistics to this json file. By default taken
+               from env var CHAIN_PROFILE_JSON (it enables profiling too)
 """
 class Chain:
-    def __init__(self, first: 'ChainLink'):
+    def __init__(self, first: 'ChainLink', profile: bool = None,
+                 profile_json: str = None):
         self.links = [first]
 
+        if profile_json is None:
+            profile_json = os.environ.get('CHAIN_PROFILE_JSON')
+        if profile is None:
+            profile = os.environ.get('CHAIN_PROFILE', '0') not in ('', '0') \
+                      or bool(profile_json)
+        self.profile = profile
+        self.profile_json = profile_json
+        # ChainProfiler of last processing
+        self.profiler = None
+
     def add(self, chain_link: 'ChainLink'):
         if inspect.isclass(chain_link):            
             raise ValueError('May be you forgot emtpy brackets () after class name')
@@ -19,48 +45,349 @@ class Chain:
         self.links.append(chain_link)
         return self
 
+    """
+    Adds Tee link: next data items go to all branches (and next links)
+    """
+    def tee(self, *branches: Union['Chain', 'ChainLink']):
+        return self.add(Tee(*branches))
+
     def process(self, data):
-        first = self.links[0]
-        first.process(data)
+        self._run(lambda first: first.process(data))
 
+    """
+    Process list of data items with first chain link as one batch
+    """
+    def process_batch(self, items: list):
+        self._run(lambda first: first.process_batch(items))
+
+    def iter(self, data, queue_size: int = 16):
+        """
+        Lazily yields items sent by last chain link while processing data.
+        Chain works in separate thread and waits while consumer takes
+        items (queue_size items or batches are ready in advance).
+        Consumer may stop iteration early (break, close()): then
+        processing is interrupted and close() of links is called instead
+        of finish(). Exceptions of chain links are raised in consumer.
+
+            for caf in Chain(CafedraArticlesFromJson()).iter(json_file):
+                ...
+        """
+        sink = _IterSink(queue_size)
+        self.add(sink)
+
+        def produce():
+            try:
+                self.process(data)
+            except ChainStopped:
+                return
+            except BaseException as ex:
+                sink.put((_IterSink.Error, ex))
+            else:
+                sink.put((_IterSink.End, None))
+
+        thread = threading.Thread(target=produce, daemon=True,
+                                  name='Chain.iter')
+        thread.start()
+        try:
+            while True:
+                kind, data = sink.queue.get()
+                if kind is _IterSink.Item:
+                    yield data
+                elif kind is _IterSink.Batch:
+                    yield from data
+                elif kind is _IterSink.Error:
+                    raise data
+                else:
+                    break
+        finally:
+            # on early stop links get ChainStopped and _run() closes them
+            sink.stop(thread)
+            self.links.pop()
+            self.links[-1].set_next(None)
+
+    def finish(self):
         for l in self.links:
             l.finish()
-        
+
+    def close(self):
+        """
+        Releases resources of links (threads, process pools, files), when
+        processing is interrupted and finish() won't be called
+        """
+        for l in self.links:
+            l.close()
+
+    def _run(self, start: Callable[['ChainLink'], None]):
+        try:
+            if not self.profile:
+                start(self.links[0])
+                self.finish()
+                return
+
+            self.profiler = ChainProfiler(self.links)
+            try:
+                start(self.profiler.first)
+                self.profiler.finish()
+            finally:
+                self.profiler.detach()
+        except BaseException:
+            # threads and process pools of links must not outlive the run
+            self.close()
+            raise
+        self.profiler.report(self.profile_json)
+
+
+
+"""
+Raised in chain links when consumer of Chain.iter() stops iteration
+"""
+class ChainStopped(Exception):
+    pass
 
 
 """
 Data processing step for Chain.
 """
 class ChainLink:
+    next_: 'ChainLink' = None
+
     """
     process data item from previous chain link
     """
     def process(self, data) -> None:
         raise NotImplementedError()
 
+    """
+    process list of data items from previous chain link.
+    Default adapter calls process() for every item, so produced items
+    go to next chain link one by one.
+    Hot links override it to process batches natively and send
+    produced items with send_batch().
+    """
+    def process_batch(self, items: list) -> None:
+        for x in items:
+            self.process(x)
+
     """
     do work on finish chain processing
     """
     def finish(self) -> None: pass
 
+    def close(self) -> None:
+        """
+        release resources (threads, files...) without finishing work,
+        called instead of finish() when chain processing is interrupted
+        """
+
     def set_next(self, link: 'ChainLink'):
         self.next_ = link
 
     def get_next(self) -> 'ChainLink':
-        r = getattr(self, 'next_', None)
-        # if not r:
-        #    raise Exception('no next chain link')
-        return r
+        return self.next_
 
     """
     sends data to next chain link
     """
-    def send(self, data):        
-        n = self.get_next()
-        if n:
-            n.process(data)
+    def send(self, data):
+        if self.next_:
+            self.next_.process(data)
+
+    """
+    sends list of data items to next chain link
+    """
+    def send_batch(self, items: list):
+        if items and self.next_:
+            self.next_.process_batch(items)
+
+"""
+Last chain link for Chain.iter(): passes items to consumer thread
+"""
+class _IterSink(ChainLink):
+    Item, Batch, Error, End = range(4)
+
+    def __init__(self, queue_size: int):
+        self.queue = queue.Queue(queue_size)
+        self._stopped = False
+
+    def process(self, data):
+        self.put((self.Item, data))
+
+    def process_batch(self, items: list):
+        self.put((self.Batch, items))
+
+    def put(self, item):
+        # waits with timeout to notice stop() while queue is full,
+        # put() may be called from threads of ThreadedLink too
+        while not self._stopped:
+            try:
+                self.queue.put(item, timeout=0.01)
+                return
+            except queue.Full:
+                pass
+        raise ChainStopped()
+
+    def stop(self, producer: threading.Thread):
+        self._stopped = True
+        producer.join()
+
 
 @dataclass
+class LinkStats:
+    link: str
+    items_in: int = 0
+    items_out: int = 0
+    # time inside process() without time of next links
+    process_time: float = 0.0
+    # time inside finish() without time of next links
+    finish_time: float = 0.0
+
+
+"""
+Proxy for chain link, which collects LinkStats of the link.
+"""
+class ProfiledLink(ChainLink):
+    def __init__(self, link: ChainLink, profiler: 'ChainProfiler',
+                 depth: int = 0):
+        self.link = link
+        self.profiler = profiler
+        # links of Tee branches are indented under Tee in report
+        self.stats = LinkStats(f'{len(profiler.proxies)}. ' + '  ' * depth
+                               + type(link).__name__)
+
+    def process(self, data):
+        self.stats.items_in += 1
+        self.stats.process_time += self.profiler.timed(self.link.process,
+                                                       data)
+
+    def process_batch(self, items: list):
+        self.stats.items_in += len(items)
+        self.stats.process_time += self.profiler.timed(
+            self.link.process_batch, items)
+
+    def finish(self):
+        self.stats.finish_time += self.profiler.timed(self.link.finish)
+
+
+"""
+Counts items sent by last chain link
+"""
+class _ProfilerSink(ChainLink):
+    def __init__(self, stats: LinkStats):
+        self.stats = stats
+
+    def process(self, data):
+        self.stats.items_out += 1
+
+    def process_batch(self, items: list):
+        self.stats.items_out += len(items)
+
+
+"""
+Inserts ProfiledLink proxies between chain links for one processing run.
+Links of Tee branches are profiled too, they follow their Tee in stats.
+"""
+class ChainProfiler:
+    def __init__(self, links: List[ChainLink]):
+        self.links = links
+        # proxies of all links including Tee branches, in report order
+        self.proxies = []
+        # (links, their proxies) of chain and of every Tee branch
+        self._runs = []
+        self._tees = []
+        self._top = self._wrap(links, 0)
+
+        # times of next links for currently running timed() calls,
+        # separate for every thread (see ThreadedLink)
+        self._local = threading.local()
+        self.start = time.perf_counter()
+        self.total_time = None
+
+    def _wrap(self, links: List[ChainLink],
+              depth: int) -> List[ProfiledLink]:
+        proxies = []
+        for l in links:
+            p = ProfiledLink(l, self, depth)
+            self.proxies.append(p)
+            proxies.append(p)
+            if isinstance(l, Tee):
+                self._tees.append(l)
+                l.branch_links = [self._wrap(b.links, depth + 1)
+                                  for b in l.branches]
+
+        for l, next_proxy in zip(links, proxies[1:]):
+            l.set_next(next_proxy)
+        links[-1].set_next(_ProfilerSink(proxies[-1].stats))
+        self._runs.append((links, proxies))
+        return proxies
+
+    @property
+    def first(self) -> ChainLink:
+        return self._top[0]
+
+    def timed(self, func, *args) -> float:
+        """
+        calls func and returns its time without time of nested timed calls
+        """
+        child_times = getattr(self._local, 'child_times', None)
+        if child_times is None:
+            child_times = self._local.child_times = []
+
+        child_times.append(0.0)
+        t = time.perf_counter()
+        try:
+            func(*args)
+        finally:
+            t = time.perf_counter() - t
+            child = child_times.pop()
+            if child_times:
+                child_times[-1] += t
+        return t - child
+
+    def finish(self):
+        # Tee finishes proxies of its branches
+        for p in self._top:
+            p.finish()
+        self.total_time = time.perf_counter() - self.start
+
+    def detach(self):
+        """
+        restores original links of chain and its Tee branches
+        """
+        for links, _ in self._runs:
+            for l, next_ in zip(links, links[1:]):
+                l.set_next(next_)
+            links[-1].set_next(None)
+        for tee in self._tees:
+            tee.branch_links = [b.links for b in tee.branches]
+
+    def get_stats(self) -> List[LinkStats]:
+        for _, proxies in self._runs:
+            for p, next_p in zip(proxies, proxies[1:]):
+                p.stats.items_out = next_p.stats.items_in
+        return [p.stats for p in self.proxies]
+
+    def report(self, json_file: str = None):
+        stats = self.get_stats()
+        print(f'{"Chain link":32} {"in":>9} {"out":>9} '
+              f'{"process, s":>11} {"finish, s":>10} {"items/s":>10}')
+        for s in stats:
+            speed = s.items_in / s.process_time if s.process_time else 0
+            print(f'{s.link[:32]:32} {s.items_in:9} {s.items_out:9} '
+                  f'{s.process_time:11.3f} {s.finish_time:10.3f} '
+                  f'{speed:10.0f}')
+        print(f'Total time: {self.total_time:.3f} s')
+
+        if json_file:
+            with open(json_file, 'w', encoding='utf8') as f:
+                json.dump({
+                    'argv': sys.argv,
+                    'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                    'total_time': self.total_time,
+                    'links': [asdict(s) for s in stats]
+                }, f, ensure_ascii=False, indent=4)
+
+
+@dataclass(slots=True)
 class SaxItem:
     event: str  # start, text, end
     name: str  # tag ...
@@ -69,18 +396,179 @@ class SaxItem:
     line: int  # input data line number, which produced this SaxItem
     
 
+@dataclass
+class XmlFile:
+    """
+    XML file (or its part) for XmlSax.
+
+    start - byte offset to start parsing from. It must point to start tag,
+            all XML from start to end (or to end of parent element of
+            start tag) must be sequence of whole elements.
+    end - byte offset to stop parsing at (None - end of parent element
+          of start tag or end of file)
+    level - level of element at start offset (see SaxItem.level)
+    """
+    path: str
+    start: int = 0
+    end: int = None
+    level: int = 0
+
+
+@dataclass
+class XmlPart:
+    """
+    Part of XML text for XmlExpat.
+
+    xml - full XML text
+    start - offset of start tag in xml, xml from start to end (or to end
+            of parent element of start tag) must be sequence of whole
+            elements
+    end - offset to stop parsing at (None - end of parent element of
+          start tag)
+    level - level of element at start offset (see SaxItem.level)
+    line - line number at start offset, if known (else it is counted)
+    offset - offset of xml in full text, if xml is only part of it
+             (line must be set then)
+
+    Line numbers continue the full text, blocks are fed to expat at
+    the same offsets as for full text, so SaxItems are equal to items
+    of this part in full text.
+    """
+    xml: str
+    start: int
+    end: int = None
+    level: int = 0
+    line: int = None
+    offset: int = 0
+
+
+@dataclass
+class XmlProgress:
+    done: int  # bytes (chars for text file objects) fed to parser
+    total: int | None  # total bytes to parse if known
+    events: int  # SAX events processed
+    seconds: float
+
+    @property
+    def events_per_sec(self) -> float:
+        return self.events / self.seconds if self.seconds else 0.0
+
+
+def print_xml_progress(p: XmlProgress):
+    total = f' of {p.total / 2**20:.1f}' if p.total else ''
+    print(f'XML: {p.done / 2**20:.1f}{total} MB, {p.events} events, '
+          f'{p.events_per_sec:.0f} events/s', flush=True)
+
+
 """
 Chain link to process XML as SAX events
 """
 class XmlSax(ChainLink, sax.ContentHandler):
-    def __init__(self, ignore_whitespace_text = True):
+    """
+    batch_size - send SaxItems to next link by lists of this size
+                 (None - send every SaxItem separately)
+    chunk_size - feed XML to incremental parser by blocks of this size.
+                 Used for XmlFile (read by mmap) and file objects when
+                 set chunk_size or progress.
+                 NB! Text split into 'text' items depends on block size.
+    progress - callback, called with XmlProgress after blocks,
+               not often than every progress_interval seconds and at end
+    """
+    SpanRoot = 'XmlSax-span-root'  # fake root element for XmlFile parts
+
+    def __init__(self, ignore_whitespace_text = True, batch_size: int = None,
+                 chunk_size: int = None,
+                 progress: Callable[[XmlProgress], None] = None,
+                 progress_interval: float = 1.0):
         self.no_white_text = ignore_whitespace_text
-        
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.progress_interval = progress_interval
+        self._buf = []
+        self._line_offset = 0
+        self._events = 0
+
+    """
+    xml - str with XML, file object or XmlFile
+    """
     def process(self, xml):
-        if isinstance(xml, str):
+        self._line_offset = 0
+        self._events = 0
+        if isinstance(xml, XmlFile):
+            self._process_file(xml)
+        elif isinstance(xml, str):
             sax.parseString(xml, self)
+        elif self.chunk_size or self.progress:
+            read_size = self.chunk_size or 2**16 - 20
+            blocks = iter(lambda: xml.read(read_size), xml.read(0))
+            self._feed(blocks, None)
         else:
             sax.parse(xml, self)
+        self.flush()
+
+    def _process_file(self, xml: XmlFile):
+        import mmap
+        with open(xml.path, 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = xml.start
+            end = len(mm) if xml.end is None else xml.end
+            read_size = self.chunk_size or 2**20
+            blocks = (mm[i:min(i + read_size, end)]
+                      for i in range(start, end, read_size))
+
+            if not start:
+                return self._feed(blocks, end - start)
+
+            # part of file is parsed inside fake root element and
+            # continues line numbers and levels of full file
+            self._line_offset = mm[:start].count(b'\n')
+            decl = mm[:mm.find(b'?>') + 2] if mm[:5] == b'<?xml' else b''
+            head = decl + f'<{self.SpanRoot}>'.encode()
+            tail = f'</{self.SpanRoot}>'.encode()
+            self._span_level = xml.level
+            try:
+                self._feed(itertools.chain([head], blocks, [tail]),
+                           end - start)
+            except sax.SAXParseException as ex:
+                # end of parent element of start tag
+                if not (xml.end is None and self.level == xml.level
+                        and 'mismatched tag' in str(ex)):
+                    raise
+
+    def _feed(self, blocks, total: int | None):
+        from xml.sax.expatreader import ExpatLocator
+
+        parser = sax.make_parser()
+        parser.setContentHandler(self)
+        self.setDocumentLocator(ExpatLocator(parser))
+
+        t = reported = time.perf_counter()
+        done = 0
+        for block in blocks:
+            parser.feed(block)
+            done += len(block)
+            if self.progress \
+                    and time.perf_counter() - reported >= self.progress_interval:
+                reported = time.perf_counter()
+                self.progress(XmlProgress(min(done, total or done), total,
+                                          self._events, reported - t))
+        parser.close()
+        if self.progress:
+            self.progress(XmlProgress(min(done, total or done), total,
+                                      self._events, time.perf_counter() - t))
+
+    def send(self, item):
+        if not self.batch_size:
+            return super().send(item)
+        self._buf.append(item)
+        if len(self._buf) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self._buf:
+            buf, self._buf = self._buf, []
+            self.send_batch(buf)
 
     def startDocument(self):
         self.level = 0
@@ -89,23 +577,406 @@ class XmlSax(ChainLink, sax.ContentHandler):
         self._loc = locator
 
     def line(self):
-        return self._loc.getLineNumber()
+        return self._loc.getLineNumber() + self._line_offset
 
     def startElement(self, name, attrs):
+        self._events += 1
+        if name == self.SpanRoot:
+            self.level = self._span_level
+            return
+        # xml.sax doesn't intern tag names, unlike XmlExpat
+        name = sys.intern(name)
         self.send(
             SaxItem('start', name, dict(attrs.copy()), self.level, self.line())
         )
         self.level += 1
 
     def characters(self, text):
+        self._events += 1
         if self.no_white_text==False or text.strip() != '':
             self.send(SaxItem('text', None, text, self.level, self.line()))
 
     def endElement(self, name):
+        self._events += 1
+        if name == self.SpanRoot:
+            return
         self.level -= 1
-        self.send(SaxItem('end', name, None, self.level, self.line()))
+        self.send(SaxItem('end', sys.intern(name), None, self.level,
+                          self.line()))
+
+
+"""
+Chain link to process XML as SAX events, the same as XmlSax,
+but with less overhead: xml.parsers.expat is used directly.
+
+XML is fed to expat by blocks of the same size, as xml.sax does,
+so stream of SaxItems (including split of text) and line numbers are
+equal to XmlSax ones.
+buffer_text - join text, split by expat, into one SaxItem (text split
+              differs from XmlSax, line is number of last text line)
+"""
+class XmlExpat(ChainLink):
+    BlockSize = 2 ** 16 - 20  # as in xml.sax.expatreader.ExpatParser
+    SpanRoot = XmlSax.SpanRoot  # fake root element for XmlPart
+
+    def __init__(self, ignore_whitespace_text = True, batch_size: int = None,
+                 buffer_text: bool = False):
+        self.no_white_text = ignore_whitespace_text
+        self.batch_size = batch_size
+        self.buffer_text = buffer_text
+
+    def process(self, xml):
+        if isinstance(xml, XmlPart):
+            return self._process_part(xml)
+        if isinstance(xml, str):
+            xml = io.StringIO(xml)
+        elif isinstance(xml, bytes):
+            xml = io.BytesIO(xml)
+
+        buf = []
+        parser = self._create_parser(buf)
+        while True:
+            block = xml.read(self.BlockSize)
+            parser.Parse(block, not block)
+            self._send_buf(buf)
+            if not block:
+                break
+
+    def _process_part(self, part: XmlPart):
+        xml, size = part.xml, self.BlockSize
+        end = len(xml) if part.end is None else part.end
+
+        if part.line is None:
+            line_offset = xml.count('\n', 0, part.start)
+        else:
+            line_offset = part.line - 1
+        buf = []
+        parser = self._create_parser(buf, part.level, line_offset,
+                                     skip_root=True)
+        parser.Parse(f'<{self.SpanRoot}>', False)
+        last = None  # last item before error
+        try:
+            pos, offset = part.start, part.offset
+            while pos < end:
+                block_end = min(((pos + offset) // size + 1) * size - offset,
+                                end)
+                parser.Parse(xml[pos:block_end], False)
+                last = buf[-1] if buf else last
+                self._send_buf(buf)
+                pos = block_end
+            parser.Parse(f'</{self.SpanRoot}>', True)
+            buf.pop()  # end of fake root
+        except expat.ExpatError as ex:
+            # end of parent element of start tag
+            last = buf[-1] if buf else last
+            if not (part.end is None and last and last.level == part.level
+                    and ex.code == expat.errors.codes[
+                        expat.errors.XML_ERROR_TAG_MISMATCH]):
+                raise
+        self._send_buf(buf)
+
+    def _create_parser(self, buf: list, level: int = 0, line_offset: int = 0,
+                       skip_root: bool = False):
+        # tag names are interned by expat
+        parser = expat.ParserCreate()
+        parser.buffer_text = self.buffer_text
+        append = buf.append
+        no_white_text = self.no_white_text
+
+        def start(name, attrs):
+            nonlocal level
+            append(SaxItem('start', name, attrs, level,
+                           parser.CurrentLineNumber + line_offset))
+            level += 1
+
+        def text(data):
+            if not no_white_text or data.strip():
+                append(SaxItem('text', None, data, level,
+                               parser.CurrentLineNumber + line_offset))
+
+        def end(name):
+            nonlocal level
+            level -= 1
+            append(SaxItem('end', name, None, level,
+                           parser.CurrentLineNumber + line_offset))
+
+        def start_root(name, attrs):
+            parser.StartElementHandler = start
+
+        parser.StartElementHandler = start_root if skip_root else start
+        parser.CharacterDataHandler = text
+        parser.EndElementHandler = end
+        return parser
+
+    def _send_buf(self, buf: list):
+        if not buf:
+            return
+        items = buf[:]
+        buf.clear()
+        if not self.batch_size:
+            for x in items:
+                self.send(x)
+        else:
+            for i in range(0, len(items), self.batch_size):
+                self.send_batch(items[i:i + self.batch_size])
+
+
+XmlEngines = {'sax': XmlSax, 'expat': XmlExpat}
+
+
+def xml_source(engine: str = 'expat', **kwargs) -> ChainLink:
+    """
+    creates XML source chain link: 'sax' - XmlSax, 'expat' - XmlExpat
+    """
+    if engine not in XmlEngines:
+        raise ValueError(f"Unknown xml engine '{engine}', "
+                         f"expected one of {list(XmlEngines)}")
+    return XmlEngines[engine](**kwargs)
         
 
+"""
+Sends every data item to several independent sub-chains (branches)
+and then to next chain link, so one pass of data feeds many consumers.
+finish() of Tee finishes branches in order.
+
+Items are not copied: branches, which change items, should be last.
+"""
+class Tee(ChainLink):
+    def __init__(self, *branches: Union[Chain, ChainLink]):
+        self.branches = [b if isinstance(b, Chain) else Chain(b)
+                         for b in branches]
+        # links of branches, ChainProfiler replaces them with its proxies
+        self.branch_links = [b.links for b in self.branches]
+
+    def process(self, data):
+        for links in self.branch_links:
+            links[0].process(data)
+        self.send(data)
+
+    def process_batch(self, items: list):
+        for links in self.branch_links:
+            links[0].process_batch(items)
+        self.send_batch(items)
+
+    def finish(self):
+        for links in self.branch_links:
+            for l in links:
+                l.finish()
+
+    def close(self):
+        for b in self.branches:
+            b.close()
+
+
+"""
+Collects all data items in list. Used by ParallelLink workers.
+"""
+class Collector(ChainLink):
+    def __init__(self):
+        self.items = []
+
+    def process(self, data):
+        self.items.append(data)
+
+    def process_batch(self, items: list):
+        self.items.extend(items)
+
+
+# chain link of ParallelLink in current worker process
+_worker_link: ChainLink = None
+
+
+def _create_inner_link(inner_link_factory) -> ChainLink:
+    link = inner_link_factory()
+    link.set_next(Collector())
+    # e.g. to build pyparsing grammars caches once per worker
+    warmup = getattr(link, 'warmup', None)
+    if warmup:
+        warmup()
+    return link
+
+
+def _run_inner_link(link: ChainLink, items: list) -> list:
+    out = link.next_.items = []
+    link.process_batch(items)
+    return out
+
+
+def _init_parallel_worker(inner_link_factory):
+    global _worker_link
+    _worker_link = _create_inner_link(inner_link_factory)
+
+
+def _process_in_worker(items: list) -> list:
+    return _run_inner_link(_worker_link, items)
+
+
+"""
+Runs stateless CPU-heavy chain link in pool of worker processes.
+Items are sent to workers by chunks, results are sent to next chain link
+in original order, so next links may be stateful.
+
+inner_link_factory - picklable callable (e.g. ChainLink class) creating
+                     inner link in every worker. If inner link has method
+                     warmup(), it is called once after creation.
+                     finish() of inner link isn't called, close() is
+                     called for workers=1 (link in current process).
+workers - number of worker processes (None - number of CPUs,
+          1 - process in current process without pool)
+chunk - number of items sent to worker at once
+"""
+class ParallelLink(ChainLink):
+    def __init__(self, inner_link_factory: Callable[[], ChainLink],
+                 workers: int = None, chunk: int = 50):
+        self.factory = inner_link_factory
+        self.workers = workers or os.cpu_count()
+        self.chunk = chunk
+
+        self._buf = []
+        self._pool = None
+        self._pending = deque()
+        self._inner = None  # inner link for workers=1
+
+    def process(self, data):
+        self._buf.append(data)
+        if len(self._buf) >= self.chunk:
+            self._submit()
+
+    def process_batch(self, items: list):
+        self._buf.extend(items)
+        while len(self._buf) >= self.chunk:
+            self._submit()
+
+    def finish(self):
+        try:
+            while self._buf:
+                self._submit()
+            while self._pending:
+                self.send_batch(self._pending.popleft().result())
+        finally:
+            self.close()
+
+    def close(self):
+        self._buf = []
+        self._pending.clear()
+        if self._pool:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+        if self._inner:
+            self._inner.close()
+            self._inner = None
+
+    def _submit(self):
+        items, self._buf = self._buf[:self.chunk], self._buf[self.chunk:]
+
+        if self.workers == 1:
+            if not self._inner:
+                self._inner = _create_inner_link(self.factory)
+            self.send_batch(_run_inner_link(self._inner, items))
+            return
+
+        if not self._pool:
+            from concurrent.futures import ProcessPoolExecutor
+            self._pool = ProcessPoolExecutor(
+                self.workers, initializer=_init_parallel_worker,
+                initargs=(self.factory,))
+
+        self._pending.append(self._pool.submit(_process_in_worker, items))
+
+        # keep limited number of chunks in work, send ready ones in order
+        while len(self._pending) > 2 * self.workers \
+                or (self._pending and self._pending[0].done()):
+            self.send_batch(self._pending.popleft().result())
+
+
+"""
+Runs chain link in its own thread. Items are passed to the thread
+through bounded queue, so fast previous links wait when queue is full.
+Next links are called from this thread too, so I/O of inner link and
+next links (file writing, db) overlaps with work of previous links.
+
+Inner link is used only from the worker thread (its finish() too),
+finish() of ThreadedLink waits for it. close() stops the thread without
+finish() of inner link. But finish() of next links is
+called from caller thread, so resources bound to thread (e.g. sqlite
+connection) should belong to inner link. Exception in the thread is
+raised in caller thread on next process() or finish() call.
+
+queue_size - max number of items (or batches) waiting in queue
+"""
+class ThreadedLink(ChainLink):
+    _Stop = object()
+    _Close = object()
+
+    def __init__(self, inner: ChainLink, queue_size: int = 64):
+        self.inner = inner
+        self._queue = queue.Queue(queue_size)
+        self._error = None
+        self._thread = None
+
+    def set_next(self, link: ChainLink):
+        self.inner.set_next(link)
+
+    def get_next(self) -> ChainLink:
+        return self.inner.get_next()
+
+    def process(self, data):
+        self._put(self.inner.process, data)
+
+    def process_batch(self, items: list):
+        self._put(self.inner.process_batch, items)
+
+    def finish(self):
+        if not self._thread:
+            self._start()
+        self._queue.put(self._Stop)
+        self._thread.join()
+        self._thread = None
+        self._raise_error()
+
+    def close(self):
+        if self._thread:
+            self._queue.put(self._Close)
+            self._thread.join()
+            self._thread = None
+        self.inner.close()
+
+    def _put(self, method, data):
+        self._raise_error()
+        if not self._thread:
+            self._start()
+        self._queue.put((method, data))
+
+    def _raise_error(self):
+        if self._error:
+            raise self._error
+
+    def _start(self):
+        self._thread = threading.Thread(
+            target=self._work, daemon=True,
+            name=f'ThreadedLink {type(self.inner).__name__}')
+        self._thread.start()
+
+    def _work(self):
+        get = self._queue.get
+        while (task := get()) is not self._Stop:
+            if task is self._Close:
+                return
+            if self._error:
+                continue  # skip all until stop, but don't block caller
+            method, data = task
+            try:
+                method(data)
+            except BaseException as ex:
+                self._error = ex
+
+        if not self._error:
+            try:
+                self.inner.finish()
+            except BaseException as ex:
+                self._error = ex
+
+
 """
 Debug chain step for printing all data
 """
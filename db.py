@@ -1,8 +1,9 @@
-from chain import Chain, ChainLink
+from chain import Chain, ChainLink, ParallelLink, ThreadedLink
 
 from book_parser import CafedraArticlesFromJson
 from article_parser import CafedraArticleParser, WholeRussiaCafedraFixer,\
-                           CafedraJsonPatcher, UnparsedCafedraEpiskopLogger
+                           CafedraJsonPatcher, UnparsedCafedraEpiskopLogger, \
+                           RowParseCache
 
 import models
 from models import CafedraOrm, EpiskopOrm, EpiskopCafedraOrm, NoteOrm
@@ -14,10 +15,12 @@ from models import UserCommentOrm, UserComment
 import human
 
 
+import functools
 import json
 import os
+import time
 from collections import Counter
-from typing import Tuple, Iterable
+from typing import Tuple, Iterable, List
 from datetime import datetime
 
 
@@ -51,6 +54,14 @@ class HistHierarhStorageBase:
     def begin_transaction(self):
         raise NotImplementedError()
 
+    def bulk_import(self):
+        """
+        returns object with begin(), add(caf: Cafedra) and commit()
+        methods for fast import of many cafedras in one transaction
+        (instead of begin_transaction(), upsert_cafedra() and commit())
+        """
+        raise NotImplementedError()
+
     def commit(self):
         raise NotImplementedError()
 
@@ -64,7 +75,7 @@ from peewee import fn, SqliteDatabase, PeeweeException  # noqa: E402
 
 
 def get_db(db_name: str):
-    db = SqliteDatabase(db_name, {
+    db = SqliteDatabase(db_name, pragmas={
         'journal_mode': 'wal',
         'cache_size': -1 * 10000,  # 10MB
         'foreign_keys': 1,
@@ -127,14 +138,20 @@ class PeeweeHistHierarhStorage(HistHierarhStorageBase):
     # def ctx(self):
     #     return self.db.bind_ctx(models.HierarhOrmModels)
 
+    # Db of models: global _Db or other one bound by bind_ctx()
+    # (see bench.py db)
+    @staticmethod
+    def _db():
+        return CafedraOrm._meta.database
+
     def begin_transaction(self):
-        _Db.begin()
+        self._db().begin()
 
     def commit(self):
-        _Db.commit()
+        self._db().commit()
 
     def rollback(self):
-        _Db.rollback()
+        self._db().rollback()
 
     @staticmethod
     def _build_search_condition(query, column):
@@ -218,75 +235,18 @@ class PeeweeHistHierarhStorage(HistHierarhStorageBase):
             is_link=caf.is_link,  # text=caf.text,
             article_json="TODO")
 
-        # TODO use Cafedra object, don't use Dto
-        cafjson = models.CafedraDto(
-            header=caf.header,
-            is_obn=caf.is_obn, is_link=caf.is_link,
-            text=caf.text,
-            id = caf_orm.id
-        )
-
-        cnt = Counter()
-        for i, ep in enumerate(caf.episkops, 1):
-            if isinstance(ep, str):
-                cafjson.episkops.append(ep)
-                continue  # TODO now table subheaders are skipped in db...
-
-            ep.episkop: EpiskopInfo
-            is_obn = caf.is_obn
-
+        def episkop_id(ep: EpiskopInfo, is_obn):
             # fixme: now we possibly merge people with same name+surname
-            ep_orm = self.find_episkop(ep.episkop.name, ep.episkop.surname)
+            ep_orm = self.find_episkop(ep.name, ep.surname)
             if not ep_orm:
-                ep_orm = EpiskopOrm.create(header=ep.episkop
-                                           .get_header(is_obn),
-                                           name=ep.episkop.name,
-                                           surname=ep.episkop.surname,
-                                           saint_title=ep.episkop.saint_title,
-                                           # todo check is it always correct?
-                                           is_obn=is_obn
-                                           )
-
-            ep.episkop.id = ep_orm.id
-            # Отдельно считаем количество раз для в/у и "настоящего"
-            cnt[(ep.episkop.id, bool(ep.temp_status))] += 1
-
-            beg = ep.begin_dating
-            end = ep.end_dating
-
-            EpiskopCafedraOrm.create(
-                episkop=ep_orm, cafedra=caf_orm,
-                begin_dating=beg.dating if beg else None,
-                estimated_begin_date=beg.estimated_date if beg
-                else None,
-                end_dating=end.dating if end else None,
-                temp_status=ep.temp_status,
-                episkop_num=i,
-                inexact=ep.inexact
-            )
-
-            epjson: EpiskopOfCafedraDto = \
-                ep.to_episkop_of_cafedra_dto(cnt[(ep.episkop.id,
-                                             bool(ep.temp_status))], is_obn)
-
-            if ep.notes:
-                epjson.episkop += ' '.join([
-                        f'<span class="note" data-note="{i}">{i}</span>'
-                        for i in ep.notes
-                ])
-
-            epjson.notes = [ArticleNote(num=note.num, text=note.text)
-                            for note in caf.notes
-                            if note.num in ep.notes]
-            caf.notes = [note for note in caf.notes if note.num not in ep.notes]
+                ep_orm = EpiskopOrm.create(**episkop_row(ep, is_obn))
+            return ep_orm.id
 
-            cafjson.episkops.append(epjson)
+        cafjson, rows = cafedra_records(caf, caf_orm.id, episkop_id)
+        for r in rows:
+            EpiskopCafedraOrm.create(**r)
 
-        cafjson.notes = [ArticleNote(num=x.num, text=x.text)
-                         for x in caf.notes]  # TODO now no notes in db
-
-        caf_orm.article_json = json.dumps(cafjson.to_dict(),
-                                          ensure_ascii=False, indent=4)
+        caf_orm.article_json = cafedra_article_json(cafjson)
         caf_orm.save()
 
         for note in caf.notes:
@@ -297,6 +257,8 @@ class PeeweeHistHierarhStorage(HistHierarhStorageBase):
             )
             note_orm.save()
 
+    def bulk_import(self) -> 'PeeweeBulkCafedraImport':
+        return PeeweeBulkCafedraImport()
 
     def find_episkop(self, name, surname=None) -> EpiskopOrm | None:
         if not name:
@@ -317,6 +279,199 @@ class PeeweeHistHierarhStorage(HistHierarhStorageBase):
         return ep_qq.get_or_none()
 
 
+def episkop_row(ep: EpiskopInfo, is_obn) -> dict:
+    return dict(header=ep.get_header(is_obn),
+                name=ep.name,
+                surname=ep.surname,
+                saint_title=ep.saint_title,
+                # todo check is it always correct?
+                is_obn=is_obn)
+
+
+def cafedra_records(caf: Cafedra, caf_id: int, episkop_id) \
+        -> Tuple[CafedraDto, List[dict]]:
+    """
+    returns article json of cafedra and rows of EpiskopCafedra table.
+    episkop_id(ep: EpiskopInfo, is_obn) - returns id of found
+    or created episkop.
+    Notes linked to episkops are removed from caf.notes.
+    """
+    # TODO use Cafedra object, don't use Dto
+    cafjson = models.CafedraDto(
+        header=caf.header,
+        is_obn=caf.is_obn, is_link=caf.is_link,
+        text=caf.text,
+        id = caf_id
+    )
+
+    rows = []
+    cnt = Counter()
+    for i, ep in enumerate(caf.episkops, 1):
+        if isinstance(ep, str):
+            cafjson.episkops.append(ep)
+            continue  # TODO now table subheaders are skipped in db...
+
+        ep.episkop: EpiskopInfo
+        is_obn = caf.is_obn
+
+        ep.episkop.id = episkop_id(ep.episkop, is_obn)
+        # Отдельно считаем количество раз для в/у и "настоящего"
+        cnt[(ep.episkop.id, bool(ep.temp_status))] += 1
+
+        beg = ep.begin_dating
+        end = ep.end_dating
+
+        rows.append(dict(
+            episkop=ep.episkop.id, cafedra=caf_id,
+            begin_dating=beg.dating if beg else None,
+            estimated_begin_date=beg.estimated_date if beg
+            else None,
+            end_dating=end.dating if end else None,
+            temp_status=ep.temp_status,
+            episkop_num=i,
+            inexact=ep.inexact
+        ))
+
+        epjson: EpiskopOfCafedraDto = \
+            ep.to_episkop_of_cafedra_dto(cnt[(ep.episkop.id,
+                                         bool(ep.temp_status))], is_obn)
+
+        if ep.notes:
+            epjson.episkop += ' '.join([
+                    f'<span class="note" data-note="{i}">{i}</span>'
+                    for i in ep.notes
+            ])
+
+        epjson.notes = [ArticleNote(num=note.num, text=note.text)
+                        for note in caf.notes
+                        if note.num in ep.notes]
+        caf.notes = [note for note in caf.notes if note.num not in ep.notes]
+
+        cafjson.episkops.append(epjson)
+
+    cafjson.notes = [ArticleNote(num=x.num, text=x.text)
+                     for x in caf.notes]  # TODO now no notes in db
+    return cafjson, rows
+
+
+def cafedra_article_json(cafjson: CafedraDto) -> str:
+    return json.dumps(cafjson.to_dict(), ensure_ascii=False, indent=4)
+
+
+class PeeweeBulkCafedraImport:
+    """
+    Import of many cafedras into new (or existing) db in one transaction:
+    rows of all tables are buffered and written by insert_many in batches.
+    Ids are assigned here (next after max id of table, as sqlite does),
+    so article_json is written once, with cafedra id inside.
+    Episkops are found in dict of loaded and added episkops, not by
+    select for every row as in upsert_cafedra().
+
+    Pragmas for build time only (they are restored by commit()):
+    synchronous off, foreign keys are checked on commit.
+    Locking mode stays normal: in WAL mode exclusive lock fails while
+    other threads have the db open.
+    All methods must be called from one thread (peewee connections
+    are per thread).
+    """
+    BatchSize = 1000
+    Tables = (CafedraOrm, EpiskopOrm, EpiskopCafedraOrm, NoteOrm)
+
+    def __init__(self):
+        self.db = PeeweeHistHierarhStorage._db()
+        self._buf = {t: [] for t in self.Tables}
+        self._next_id = {}
+        self._episkops = {}
+        self._pragmas = {}
+
+    def begin(self):
+        self._pragmas['synchronous'] = \
+            self.db.execute_sql('PRAGMA synchronous').fetchone()[0]
+        self.db.execute_sql('PRAGMA synchronous = OFF')
+
+        self.db.begin()
+        # is reset by commit
+        self.db.execute_sql('PRAGMA defer_foreign_keys = ON')
+
+        for t in self.Tables:
+            self._next_id[t] = (t.select(fn.MAX(t.id)).scalar() or 0) + 1
+
+        q = EpiskopOrm.select(EpiskopOrm.id, EpiskopOrm.name,
+                              EpiskopOrm.surname).order_by(EpiskopOrm.id)
+        for ep_id, name, surname in q.tuples():
+            key = (name.lower(),
+                   surname.lower() if surname is not None else None)
+            self._episkops.setdefault(key, ep_id)
+
+    def add(self, caf: Cafedra):
+        caf_id = self._new_id(CafedraOrm)
+        cafjson, rows = cafedra_records(caf, caf_id, self._episkop_id)
+
+        self._buf[CafedraOrm].append(dict(
+            id=caf_id, header=caf.header, is_obn=caf.is_obn,
+            is_link=caf.is_link,  # text=caf.text,
+            article_json=cafedra_article_json(cafjson)))
+        for r in rows:
+            r['id'] = self._new_id(EpiskopCafedraOrm)
+        self._buf[EpiskopCafedraOrm] += rows
+        for note in caf.notes:
+            self._buf[NoteOrm].append(dict(
+                id=self._new_id(NoteOrm), text=note.text,
+                cafedra_id=caf_id))
+
+        if len(self._buf[EpiskopCafedraOrm]) >= self.BatchSize:
+            self.flush()
+
+    def flush(self):
+        from peewee import chunked
+
+        for t, rows in self._buf.items():
+            for batch in chunked(rows, self.BatchSize):
+                t.insert_many(batch).execute()
+            rows.clear()
+
+    def commit(self):
+        try:
+            self.flush()
+            self.db.commit()
+        except BaseException:
+            # pragmas can't be changed inside transaction
+            self.db.rollback()
+            raise
+        finally:
+            for name, value in self._pragmas.items():
+                self.db.execute_sql(f'PRAGMA {name} = {value}')
+
+    def close(self):
+        """
+        closes db connection of current thread (importer may work
+        in ThreadedLink thread, other threads read db after import)
+        """
+        self.db.close()
+
+    def _new_id(self, table) -> int:
+        i = self._next_id[table]
+        self._next_id[table] = i + 1
+        return i
+
+    def _episkop_id(self, ep: EpiskopInfo, is_obn) -> int:
+        # the same search as in find_episkop()
+        if not ep.name:
+            raise ValueError('name must be not empty!')
+        key = (ep.name.lower(), ep.surname.lower() if ep.surname else None)
+        # NN is unknown man, so two NNs are different
+        if ep.name == 'NN' and not ep.surname:
+            ep_id = None
+        else:
+            ep_id = self._episkops.get(key)
+        if ep_id is None:
+            ep_id = self._new_id(EpiskopOrm)
+            self._buf[EpiskopOrm].append(dict(id=ep_id,
+                                              **episkop_row(ep, is_obn)))
+            self._episkops.setdefault(key, ep_id)
+        return ep_id
+
+
 class PeeweeUserCommentsStorage:
     @staticmethod
     def create_new_sqlite_db(remove_if_exists):
@@ -352,16 +507,49 @@ class StorageException(Exception):
 
 
 class CafedraDbImporter(ChainLink):
-    def __init__(self, db: HistHierarhStorageBase):
+    def __init__(self, db: HistHierarhStorageBase, bulk: bool = False):
+        """
+        bulk - import with db.bulk_import() instead of upsert_cafedra()
+        """
         self.db = db
-        self.db.begin_transaction()
+        self.bulk = bulk
+        # Transaction is started by first imported cafedra, so importer
+        # may work in other thread (see ThreadedLink): sqlite connections
+        # and transactions of peewee are per thread.
+        self._in_transaction = False
+        self._bulk_import = None
 
     @human.show_exception
     def process(self, s: Cafedra):
-        self.db.upsert_cafedra(s)
+        self._begin()
+        self._upsert(s)
+
+    @human.show_exception
+    def process_batch(self, items: List[Cafedra]):
+        self._begin()
+        upsert = self._upsert
+        for s in items:
+            upsert(s)
 
     def finish(self):
-        self.db.commit()
+        if self._bulk_import:
+            try:
+                self._bulk_import.commit()
+            finally:
+                self._bulk_import.close()
+        elif self._in_transaction:
+            self.db.commit()
+
+    def _begin(self):
+        if not self._in_transaction:
+            if self.bulk:
+                self._bulk_import = self.db.bulk_import()
+                self._bulk_import.begin()
+                self._upsert = self._bulk_import.add
+            else:
+                self.db.begin_transaction()
+                self._upsert = self.db.upsert_cafedra
+            self._in_transaction = True
 
 
 if __name__ == "__main__":
@@ -387,6 +575,7 @@ if __name__ == "__main__":
     cmd, arg = sys.argv[1:]
 
     if cmd == 'build' and arg in ('main', 'all', 'main-old'):
+        start = time.perf_counter()
         PeeweeHistHierarhStorage.create_new_sqlite_db(remove_if_exists=True)
         db = PeeweeHistHierarhStorage()
 
@@ -397,15 +586,23 @@ if __name__ == "__main__":
         if arg == 'main-old':
             patch_file = 'data/patch/cafedra-episkop-patch-old.txt'
 
-        ch = Chain(CafedraArticlesFromJson()) \
+        # parsed episkop rows are cached between builds
+        row_cache_file = 'data/row_parse_cache.sqlite3'
+        row_cache = RowParseCache(row_cache_file)
+        row_cache.reset_stats()
+
+        ch = Chain(CafedraArticlesFromJson(batch_size=100)) \
             .add(CafedraJsonPatcher(patch_file)) \
-            .add(CafedraArticleParser()) \
+            .add(ParallelLink(functools.partial(CafedraArticleParser,
+                                                row_cache_file))) \
 
         # comment this when using sample_cafedry.xml
         ch = ch.add(WholeRussiaCafedraFixer())
 
+        # db writes work in separate thread in parallel
+        # with json loading and parsing
         ch = ch.add(UnparsedCafedraEpiskopLogger('data/cafedra-episkop-fail.txt')) \
-               .add(CafedraDbImporter(db))
+               .add(ThreadedLink(CafedraDbImporter(db, bulk=True)))
 
         if arg == 'main-old':
             ch.process('data/cafedra_articles.json')  # old file built from xml
@@ -415,6 +612,8 @@ if __name__ == "__main__":
 
         print("Created cafedras:", db.count_cafedra())
         print("Created episkops:", db.count_episkop())
+        print(row_cache.report())
+        print(f'Build time: {time.perf_counter() - start:.1f} s')
     elif arg == 'comments':
         if cmd == 'create':
             f = False
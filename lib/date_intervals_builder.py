@@ -1,5 +1,7 @@
 import calendar
 from datetime import date
+from functools import lru_cache
+from typing import Iterable, List, Tuple
 
 
 class DateIntervalsBuilder(object):
@@ -143,6 +145,57 @@ class DateInterval(object):
     def __repr__(self) -> str:
         return "DateInterval<%s, %s>" % (self.begin, self.end)
 
+
+# Fast estimation of single date: the same interval as
+# DateIntervalsBuilder().add_date(year, month, day).build() gives,
+# but as (begin, end) ordinals of date.toordinal() without builder objects
+
+@lru_cache(maxsize=None)
+def month_length(year, month) -> int:
+    return calendar.monthrange(year, month)[1]
+
+
+@lru_cache(maxsize=None)
+def _month_start(year, month) -> int:
+    return date(year, month, 1).toordinal()
+
+
+def estimate_date_interval(year, month=None, day=None) \
+        -> Tuple[int, int] | None:
+    """
+    returns (begin, end) ordinals of date interval or None if year
+    isn't specified. Raises ValueError for wrong year, month or day
+    like date() does
+    """
+    if not year:
+        return None
+    if not month and not day:
+        return _month_start(year, 1), _month_start(year, 12) + 30
+
+    begin = _month_start(year, month or 1)
+    if not day:
+        return begin, begin + month_length(year, month) - 1
+    if not 1 <= day <= month_length(year, month or 1):
+        raise ValueError('day is out of range for month')
+    begin += day - 1
+    return begin, begin
+
+
+def estimate_date_intervals(dates: Iterable[Tuple[int, int, int]]) \
+        -> List[Tuple[int, int] | None]:
+    """
+    estimate_date_interval for column of (year, month, day) dates,
+    None for dates without year or with wrong year, month or day
+    """
+    res = []
+    for year, month, day in dates:
+        try:
+            res.append(estimate_date_interval(year, month, day))
+        except ValueError:
+            res.append(None)
+    return res
+
+
 def _test():
     d = DateInterval()
     d.set_year(2019)
@@ -166,6 +219,47 @@ def _test():
     d.set_days_range(10, 18)
     print(d)
 
+    _test_estimate_date_interval()
+
+
+def _test_estimate_date_interval():
+    import time
+
+    def by_builder(year, month, day):
+        b = DateIntervalsBuilder()
+        try:
+            b.add_date(year, month, day)
+            items = b.build()
+        except ValueError as ex:
+            return str(ex)
+        return (items[0].begin.toordinal(), items[0].end.toordinal()) \
+            if items else None
+
+    def estimate(year, month, day):
+        try:
+            return estimate_date_interval(year, month, day)
+        except ValueError as ex:
+            return str(ex)
+
+    dates = [(y, m, d) for y in (None, 0, 1, 100, 754, 1378, 1900, 1924,
+                                 2000, 2019, 2100, 9999)
+             for m in (None, 0, 1, 2, 6, 12, 13)
+             for d in (None, 0, 1, 28, 29, 30, 31, 32)]
+    diff = [(x, by_builder(*x), estimate(*x)) for x in dates
+            if by_builder(*x) != estimate(*x)]
+    print(f'Dates: {len(dates)}, differences with builder: {diff}')
+
+    column = [(y, m, d) for y in range(1850, 1950)
+              for m in range(1, 13) for d in (None, 1, 15, 28)] * 10
+    for title, f in (
+            ('DateIntervalsBuilder', lambda: [by_builder(*x) for x in column]),
+            ('estimate_date_intervals',
+             lambda: estimate_date_intervals(column))):
+        t = time.perf_counter()
+        f()
+        print(f'{title:24} {time.perf_counter() - t:.3f} s '
+              f'for {len(column)} dates')
+
 
 if __name__ == "__main__":
     _test()
\ No newline at end of file
@@ -1,4 +1,6 @@
 import re
+from functools import lru_cache
+from typing import List
 
 
 class EngInRusWordsTextPreprocessor:
@@ -44,6 +46,71 @@ class EngInRusWordsTextPreprocessor:
         return text
 
 
+class RusTextNormalizer:
+    """
+    Нормализатор текста книги за один проход регулярного выражения:
+    * \\u2028 (UNICODE LINE SEPARATOR) заменяется пробелом, а после дефиса
+      удаляется (Бобрикович-Копоть-\\u2028Анехожский);
+    * латинские буквы, похожие на кириллические, в кириллических словах
+      заменяются кириллическими, как в EngInRusWordsTextPreprocessor.
+
+    Результаты запоминаются в LRU-кэше - в книге много повторяющихся
+    фрагментов текста.
+    """
+
+    _engLetters = EngInRusWordsTextPreprocessor._engLetters
+    _translate_table = EngInRusWordsTextPreprocessor._translate_table
+
+    # Серия латинских букв заменяется, если перед ней или после неё
+    # кириллическая буква - то же, что последовательные _re1 и _re2
+    # EngInRusWordsTextPreprocessor
+    _re_words = r"(?<=[а-яА-ЯёЁ])[%s]+|[%s]+(?=[а-яА-ЯёЁ])" \
+                % (_engLetters, _engLetters)
+    _re_single = r"\b[%s]\b" % _engLetters
+    _re_u2028 = r"\u2028"
+    # строки без \u2028 и латинских букв-двойников возвращаются как есть
+    _re_candidate = re.compile(r"[\u2028%s]" % _engLetters)
+
+    def __init__(self, replace_single=False, cache_size=2**16):
+        """
+        :param replace_single: заменять ли одиночные буквы
+        NB! Может сломать гиперссылки и английские тексты
+        :param cache_size: размер LRU-кэша, None - без ограничения
+        """
+        parts = [self._re_u2028, self._re_words]
+        if replace_single:
+            parts.append(self._re_single)
+        sub = re.compile("|".join(parts)).sub
+        candidate = self._re_candidate.search
+        table = self._translate_table
+
+        def replace(match):
+            t = match.group()
+            if t == '\u2028':
+                # удаляется после дефиса: Бобрикович-Копоть-\u2028Анехожский
+                i = match.start()
+                if i > 1 and match.string[i - 1] == '-':
+                    return ''
+                return ' '
+            return t.translate(table)
+
+        @lru_cache(maxsize=cache_size)
+        def normalize(text):
+            if candidate(text) is None:
+                return text
+            return sub(replace, text)
+
+        self.normalize = normalize
+        self.cache_info = normalize.cache_info
+
+    def normalize_batch(self, texts: List[str]) -> List[str]:
+        """
+        Нормализует список строк, None и пустые строки не изменяются
+        """
+        normalize = self.normalize
+        return [normalize(t) if t else t for t in texts]
+
+
 if __name__ == "__main__":
     p = EngInRusWordsTextPreprocessor()
     
@@ -54,3 +121,10 @@ if __name__ == "__main__":
         print("Something wrong")
     else:
         print("OK")
+
+    n = RusTextNormalizer(replace_single=True)
+    if rus != n.normalize(eng) \
+       or n.normalize("Копоть-\u2028Анехожский\u2028c") != "Копоть-Анехожский с":
+        print("RusTextNormalizer: something wrong")
+    else:
+        print("RusTextNormalizer: OK")
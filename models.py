@@ -131,7 +131,7 @@ class UserComment(_HHModel):
 #   ------ Models for book parser of chapter 'Списки иерархов по кафедрам'
 
 
-@dataclass
+@dataclass(slots=True)
 class CafedraArticle:
     header: str = None
     is_obn: bool = False
@@ -164,12 +164,12 @@ class CafedraArticle:
         return asdict(self)
 
 
-@dataclass
+@dataclass(slots=True)
 class ArticleEpiskopRow:
     text: str = None
 
 
-@dataclass
+@dataclass(slots=True)
 class ArticleNote:
     num: int
     text: str
@@ -4,8 +4,10 @@ import re
 
 try:
     from parsers.fail import ParseFail
+    from parsers.memo import lru_cache_copy
 except ImportError:
     from fail import ParseFail
+    from memo import lru_cache_copy
 
 
 @dataclass
@@ -17,7 +19,12 @@ class ParsedDating:
     prefix: str = None  # около, лето, не ранее и т.д.
 
 
+@lru_cache_copy()
 def parse_dating(s) -> ParsedDating | ParseFail:
+    return parse_dating_fast(s) or parse_dating_pyparsing(s)
+
+
+def parse_dating_pyparsing(s) -> ParsedDating | ParseFail:
     try:
         d = Dating.parse_string(s, parse_all=True).as_dict()
         return ParsedDating(dating=s, **d)
@@ -45,6 +52,45 @@ Dating = Opt(dating_prefix) + (\
          ) + Opt(brackets).suppress()
 
 
+# ---------- Fast path: regex for the most frequent datings ---------------
+# 31.10.1859, 10(23)11.1921, 19.06(02.07)1930, 02.1378, 1380, кон. 1927
+# Day, Month, Year and prefix are the same regexps as in Dating grammar:
+# every number is followed by separator or end of string, so regex
+# backtracking gives the same tokens as pyparsing.
+# Whitespace between prefix and date - pyparsing default whitespace.
+# pyparsing expands tabs in parsed string, so datings with tabs
+# are left for it.
+# Brackets with old style date contain only digits and dots,
+# other datings (spaces, question marks etc.) are parsed by pyparsing.
+_fast_sep = r'(?: \. | \(\d[\d.]*\)\.? )'
+_fast_dating_re = re.compile(rf'''
+    (?: (?P<prefix> (не\s+)?[а-я]+(\.?) ) [ \r\n]* )?
+    (?:
+        (?: (?P<day> 30 | 31 | [12]\d | 0?[1-9] ) {_fast_sep} )?
+        (?P<month> 1[012] | 0?[1-9] ) {_fast_sep}
+    )?
+    (?P<year> 2[01]\d\d | 1\d{{3}} | \d{{2,3}} )
+    (?: \(\d[\d.]*\) )?
+    ''', flags=re.X)
+
+
+def parse_dating_fast(s) -> ParsedDating | None:
+    """
+    returns the same ParsedDating as pyparsing Dating grammar
+    or None if dating has no simple form and must be parsed by pyparsing
+    """
+    if '\t' in s:
+        return None
+    m = _fast_dating_re.fullmatch(s)
+    if not m:
+        return None
+    prefix, day, month, year = m.group('prefix', 'day', 'month', 'year')
+    return ParsedDating(dating=s, year=int(year),
+                        month=int(month) if month else None,
+                        day=int(day) if day else None,
+                        prefix=prefix)
+
+
 if __name__ == '__main__':
     tests = '''
 31.10.1859
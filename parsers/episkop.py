@@ -5,8 +5,10 @@ from pyparsing import Regex, Opt, Word, Char, nested_expr, \
 
 try:
     from parsers.fail import ParseFail
+    from parsers.memo import lru_cache_copy
 except ImportError:
     from fail import ParseFail
+    from memo import lru_cache_copy
 
 
 @dataclass
@@ -28,7 +30,12 @@ class ParsedEpiskopInCafedra:
     brackets_content: str = None
 
 
+@lru_cache_copy()
 def parse_episkop_name_in_cafedra(s) -> ParsedEpiskopInCafedra:
+    return parse_episkop_name_fast(s) or parse_episkop_name_pyparsing(s)
+
+
+def parse_episkop_name_pyparsing(s) -> ParsedEpiskopInCafedra:
     try:
         d = EpiskopInCafedra.parse_string(s, parse_all=True).as_dict()
         if '?' in d.get('temp_status', ''):
@@ -65,7 +72,8 @@ Temp = original_text_for(Temp)('temp_status')
 NumberAferName = RimNumber('number_after_name')
 NumberAferSurnname = RimNumber('number_after_surname')
 
-Paki = Char(',') + Regex(r'паки|(в\s+\d+-й\s+раз)|(в (третий|четвертый) раз)')('paki')
+PakiText = Regex(r'паки|(в\s+\d+-й\s+раз)|(в (третий|четвертый) раз)')
+Paki = Char(',') + PakiText('paki')
 
 
 WorldTitle = Opt(Char(',')) + Regex(r'кн(язь|\.)')('world_title')
@@ -79,6 +87,68 @@ EpiskopInCafedra = Opt(Temp) + Opt(SaintTitle) + \
                         Opt('.')
 
 
+# ---------- Fast path: tokenizer for the most frequent names -------------
+# Вассиан, Ираклий Северицкий, в/у Михаил II Бирюков, паки,
+# Сщмч. Кирион Садзегели, Харитон Обрынский-Угровецкий.
+# Tokens are matched one after another without backtracking, like
+# pyparsing does, by regexps of EpiskopInCafedra grammar.
+# Names with brackets, question marks, "кн." and so on are parsed
+# by pyparsing, tabs are expanded by pyparsing and left for it too.
+_ws_re = re.compile(r'[ \n\r]*')  # pyparsing default whitespace
+_temp_re = re.compile(r'в/у')
+_capitalized_word_re = re.compile(r'[А-ЯЁ][а-яё]+')
+_surname_re = re.compile(r'[А-ЯЁ][а-яё]+(-[А-ЯЁ][а-яё]+)?')
+_comma_re = re.compile(r',')
+_dot_re = re.compile(r'\.')
+
+
+def parse_episkop_name_fast(s) -> ParsedEpiskopInCafedra | None:
+    """
+    returns the same ParsedEpiskopInCafedra as pyparsing
+    EpiskopInCafedra grammar or None if name has no simple form
+    and must be parsed by pyparsing
+    """
+    if '(' in s or '?' in s or '\t' in s:
+        return None
+
+    pos = 0
+
+    def match(regex):
+        nonlocal pos
+        m = regex.match(s, _ws_re.match(s, pos).end())
+        if m:
+            pos = m.end()
+        return m
+
+    d = {}
+    if match(_temp_re):
+        d['temp_status'] = 'в/у'
+    if m := match(SaintTitle.re):
+        d['saint_title'] = m.group().strip()
+    if not (m := match(_capitalized_word_re)):
+        return None
+    d['name'] = m.group()
+    if m := match(RimNumber.re):
+        d['number_after_name'] = m.group()
+    if m := match(_surname_re):
+        start = m.start()
+        match(_capitalized_word_re)
+        d['surname'] = s[start:pos]
+        if m := match(RimNumber.re):
+            d['number_after_surname'] = m.group()
+
+    before_paki = pos
+    if match(_comma_re) and (m := match(PakiText.re)):
+        d['paki'] = m.group()
+    else:
+        pos = before_paki
+    match(_dot_re)
+
+    if _ws_re.match(s, pos).end() != len(s):
+        return None
+    return ParsedEpiskopInCafedra(text=s, **d)
+
+
 if __name__ == '__main__':
     tests = """
 Вассиан
@@ -0,0 +1,22 @@
+from copy import copy
+from functools import lru_cache, wraps
+
+
+def lru_cache_copy(maxsize: int = 2**14):
+    """
+    lru_cache for parse functions, returning mutable results
+    (dataclasses): every call returns shallow copy of cached result,
+    so changes of result by caller don't change cache.
+    cache_info() and cache_clear() of lru_cache are available.
+    """
+    def decorator(func):
+        cached = lru_cache(maxsize=maxsize)(func)
+
+        @wraps(func)
+        def wrapper(s):
+            return copy(cached(s))
+
+        wrapper.cache_info = cached.cache_info
+        wrapper.cache_clear = cached.cache_clear
+        return wrapper
+    return decorator
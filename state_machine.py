@@ -1,5 +1,7 @@
 from dataclasses import dataclass
-from typing import List, Dict
+from typing import List, Dict, Callable, Any
+import json
+import logging
 
 @dataclass
 class State:
@@ -35,9 +37,12 @@ class State:
                 elif st in self.cycle:
                     raise ValueError(f"State '{st}' can't be next - it is in .cycle")
 
+# debug level of this logger enables log of state machines work
+# (it is checked on machine creation)
+logger = logging.getLogger(__name__)
+
 def log(s):
-#    print(s)
-    pass
+    logger.debug(s)
 
 class StateMachine:
     def __init__(self, states = List[State], init_state: str = None, event_handler = None):
@@ -57,38 +62,73 @@ class StateMachine:
         self.last_data = None
 
         self.receiver = event_handler
+        self.tracer = None
+        self._log = logger.isEnabledFor(logging.DEBUG)
+
+    def set_tracer(self, tracer: 'TransitionTracer'):
+        """
+        Enables (or disables if tracer is None) tracing of signals.
+        Without tracer signal() works without any tracing overhead.
+        """
+        self.tracer = tracer
+        if tracer:
+            self.signal = self._traced_signal
+        else:
+            self.__dict__.pop('signal', None)
 
-    def add_state(name, cycle, next_state):
+    def _traced_signal(self, signal: str, data = None):
+        tracer = self.tracer
+        old = self.state.name
+        tracer.depth += 1
+        try:
+            result = type(self).signal(self, signal, data)
+        except BaseException as ex:
+            tracer.add(signal, old, self.state.name, f'error: {ex!r}', data)
+            if tracer.depth == 1:
+                tracer.dump_on_error()
+            raise
+        else:
+            tracer.add(signal, old, self.state.name, result, data)
+        finally:
+            tracer.depth -= 1
+        return result
+
+    def add_state(self, name, cycle, next_state):
         self._states[name] = State(name, cycle, next_state)
 
     def signal(self, signal: str, data = None):
-        log(f"StateMachine:: signal({signal}) state={self.state.name}")
+        if self._log:
+            log(f"StateMachine:: signal({signal}) state={self.state.name}")
         self.last_signal = signal
         self.last_data = data
         
         if signal in self.state.cycle:
             self._callback('cycle')
-            return
+            return 'cycle'
         elif signal in self.state.next_state:            
             next_state = self.state.next_state[signal]
-            self.set_state(next_state)
+            return 'next' if self.set_state(next_state) else 'cancel'
         else:
             resolved = self._callback('fail')
             if not resolved: 
                 raise WrongSignalException(f"Can't process signal '{signal}' at state {self.state}")
+            return 'fail'
             
     def set_state(self, new_state, run_callbacks=True):
         assert new_state in self._states
-        log(f"StateMachine:: set_state('{new_state}') signal {self.last_signal}")
+        if self._log:
+            log(f"StateMachine:: set_state('{new_state}') signal {self.last_signal}")
 
         if new_state == self.state.name:
-            log('StateMachine:: set_state fail because SAME')
+            if self._log:
+                log('StateMachine:: set_state fail because SAME')
             return False
 
         if run_callbacks:
             cancel = self._callback('exit')
             if cancel:
-                log('StateMachine:: set_state fail because CANCEL')
+                if self._log:
+                    log('StateMachine:: set_state fail because CANCEL')
                 return False
             
         self.prev_state = self.state
@@ -117,4 +157,233 @@ class StateMachine:
                 res = res or f(self.last_signal, self.last_data, self)
         return res
         
+
+class CompiledStateMachine(StateMachine):
+    """
+    StateMachine with the same behaviour, but faster:
+    states and signals are numbered, transitions are in table
+    [state number][signal number], callbacks of receiver are found once
+    in constructor (so receiver shouldn't change its on_* methods later).
+    add_state() rebuilds the table.
+    """
+    _FAIL = -1
+    _CYCLE = -2
+    _Events = ('enter', 'cycle', 'exit', 'fail')
+
+    def __init__(self, states = List[State], init_state: str = None, event_handler = None):
+        super().__init__(states, init_state, event_handler)
+        self._compile()
+
+    def add_state(self, name, cycle, next_state):
+        super().add_state(name, cycle, next_state)
+        self._compile()
+
+    def _compile(self):
+        states = list(self._states.values())
+        self._state_list = states
+        self._state_ids = {st.name: i for i, st in enumerate(states)}
+
+        signals = {}
+        for st in states:
+            for sig in list(st.cycle) + list(st.next_state):
+                signals.setdefault(sig, len(signals))
+        self._signal_ids = signals
+
+        self._table = []
+        for st in states:
+            row = [self._FAIL] * len(signals)
+            for sig, next_state in st.next_state.items():
+                row[signals[sig]] = self._state_ids[next_state]
+            for sig in st.cycle:
+                row[signals[sig]] = self._CYCLE
+            self._table.append(row)
+
+        # callbacks[event][state number] - tuple of receiver methods
+        self._callbacks = {}
+        for event in self._Events:
+            self._callbacks[event] = [self._find_callbacks(st, event)
+                                      for st in states]
+
+        self._state_id = self._state_ids[self.state.name]
+
+    def _find_callbacks(self, state: State, event: str) -> tuple:
+        if not self.receiver:
+            return ()
+        res = (getattr(self.receiver, 'on_' + event + '_state', None),
+               getattr(self.receiver,
+                       'on_' + state.name + '_' + event, None))
+        return tuple(f for f in res if f)
+
+    def signal(self, signal: str, data = None):
+        if self._log:
+            log(f"StateMachine:: signal({signal}) state={self.state.name}")
+        self.last_signal = signal
+        self.last_data = data
+
+        sig = self._signal_ids.get(signal)
+        action = self._FAIL if sig is None else self._table[self._state_id][sig]
+
+        if action == self._CYCLE:
+            self._run_callbacks('cycle')
+            return 'cycle'
+        elif action >= 0:
+            return 'next' if self._set_state(action, True) else 'cancel'
+        else:
+            resolved = self._run_callbacks('fail')
+            if not resolved:
+                raise WrongSignalException(f"Can't process signal '{signal}' at state {self.state}")
+            return 'fail'
+
+    def set_state(self, new_state, run_callbacks=True):
+        assert new_state in self._states
+        return self._set_state(self._state_ids[new_state], run_callbacks)
+
+    def _set_state(self, new_id: int, run_callbacks: bool):
+        if self._log:
+            log(f"StateMachine:: set_state('{self._state_list[new_id].name}') signal {self.last_signal}")
+
+        if new_id == self._state_id:
+            if self._log:
+                log('StateMachine:: set_state fail because SAME')
+            return False
+
+        if run_callbacks:
+            cancel = self._run_callbacks('exit')
+            if cancel:
+                if self._log:
+                    log('StateMachine:: set_state fail because CANCEL')
+                return False
+
+        self.prev_state = self.state
+        self.state = self._state_list[new_id]
+        self._state_id = new_id
+
+        if run_callbacks:
+            self._run_callbacks('enter')
+
+        return True
+
+    def _run_callbacks(self, event):
+        res = False
+        for f in self._callbacks[event][self._state_id]:
+            res = res or f(self.last_signal, self.last_data, self)
+        return res
+
+
+@dataclass
+class Transition:
+    signal: str
+    old_state: str
+    new_state: str
+    # result of signal(): cycle, next, cancel (exit callback canceled
+    # transition), fail (fail callback resolved signal) or error: ...
+    result: str
+    line: Any  # data.line if data has it
+    data: Any  # serialized signal data
+    # >0 for signal() called from callback of other signal(), such
+    # transitions are saved before transition of outer signal
+    depth: int = 0
+
+
+class TransitionTracer:
+    """
+    Keeps last `size` transitions of StateMachine in ring buffer
+    and saves them to dump_file on exception in StateMachine.signal().
+    serialize_data - converts signal data to json compatible value
+                     for dump, by default str()
+    """
+    def __init__(self, size: int = 1000, dump_file: str = None,
+                 serialize_data: Callable[[Any], Any] = None):
+        self.size = size
+        self.dump_file = dump_file
+        self.serialize_data = serialize_data or str
+        self.depth = 0  # nesting of traced signal() calls
+
+        self._items = [None] * size
+        self._pos = 0
+        self._count = 0
+
+    def add(self, signal, old_state, new_state, result, data):
+        self._items[self._pos] = (signal, old_state, new_state, result, data,
+                                  self.depth - 1)
+        self._pos = (self._pos + 1) % self.size
+        self._count += 1
+
+    def transitions(self) -> List[Transition]:
+        if self._count < self.size:
+            items = self._items[:self._count]
+        else:
+            items = self._items[self._pos:] + self._items[:self._pos]
+
+        return [Transition(sig, old, new, res, getattr(data, 'line', None),
+                           self.serialize_data(data) if data is not None
+                           else None, depth)
+                for sig, old, new, res, data, depth in items]
+
+    def dump(self, filename: str):
+        with open(filename, 'w', encoding='utf8') as f:
+            for t in self.transitions():
+                f.write(json.dumps(t.__dict__, ensure_ascii=False) + '\n')
+
+    def dump_on_error(self):
+        if self.dump_file:
+            self.dump(self.dump_file)
+            logger.warning(f'State machine trace saved to {self.dump_file}')
+
+    @staticmethod
+    def load(filename: str) -> List[Transition]:
+        with open(filename, encoding='utf8') as f:
+            return [Transition(**json.loads(l)) for l in f if l.strip()]
+
+
+def replay(transitions: List[Transition], machine: StateMachine,
+           load_data: Callable[[Any], Any] = None,
+           start_signals: List[str] = None,
+           send: Callable[[str, Any], Any] = None,
+           start_state: str = None) -> List[Transition]:
+    """
+    Re-drives machine by signals of dumped trace (see TransitionTracer).
+    Machine is set to start_state (by default old state of first replayed
+    transition) without callbacks. Exception of machine is raised as in
+    original run.
+
+    load_data - restores signal data from serialized value
+    start_signals - skip transitions before first of these signals
+                    (e.g. receiver needs start of article)
+    start_state - state, which receiver is prepared for. Trace of ring
+                  buffer may start in the middle of data (old state of
+                  first start signal is e.g. end of previous article),
+                  exit callbacks of that state can't work without
+                  previous signals
+    send - function (signal, data) to send signal, by default
+           machine.signal
+    Returns transitions, which gave different new state.
+    """
+    send = send or machine.signal
+    # nested signals are sent again by callbacks of outer ones
+    transitions = [t for t in transitions if t.depth == 0]
+    if start_signals:
+        for i, t in enumerate(transitions):
+            if t.signal in start_signals:
+                transitions = transitions[i:]
+                break
+
+    if not transitions:
+        return []
+
+    machine.set_state(start_state or transitions[0].old_state,
+                      run_callbacks=False)
+    diff = []
+    for t in transitions:
+        data = t.data
+        if load_data and data is not None:
+            data = load_data(data)
+        if t.result.startswith('error: '):
+            logger.warning(f'Replay of failed signal: {t}')
+        send(t.signal, data)
+        if machine.state.name != t.new_state:
+            diff.append(t)
+    return diff
+
+
 class WrongSignalException(Exception): pass